@@ -1,25 +1,26 @@
 # commands.py
 import traceback
 import nextcord
-import random
 
 from datetime import datetime
-from typing import Tuple, Any
+from typing import Tuple, List
 from nextcord import VoiceProtocol
 from nextcord.ext import commands
 from nextcord.ext.commands import Context, Bot
 from lib.helpers.Utils import Util, ConfigUtil
 from lib.helpers.Embeds import Embeds
 from lib.helpers.SpotifyParser import SpotifyParser
+from lib.helpers.Song import Song
 from lib.helpers.SongQueue import SongQueue
 from lib.helpers.SongSearch import SongSearch
+from lib.helpers.Resolver import Resolver
 from lib.ui import views
 from lib.helpers.LyricsParser import LyricsParser
 from traceback import format_exc
 
 # Outside of class to allow config defined role names to be read by decorators
 config_obj = ConfigUtil()
-config = config_obj.read_config('BOT_SETTINGS')
+config = config_obj.get_bot_settings()
 
 class Commands(commands.Cog):
     """
@@ -28,26 +29,39 @@ class Commands(commands.Cog):
 
     def __init__(self, bot: Bot):
         self.bot = bot
-        self.queues = SongQueue(bot)
-        self.utilities = Util()
-        self.embeds = Embeds(bot)
+        self.resolver = Resolver(config, **config_obj.app_settings().get('Resolver', {}))
+        self.utilities = Util(config, self.resolver)
+        self.embeds = Embeds(bot, config)
+        self.queues = SongQueue(bot, config, self.utilities, self.embeds)
 
         # Get config values
-        self.doom_playlist = config['doom_playlist']
-        self.ydl_opts = config['ydl_opts']
-        self.ffmpeg_opts = config['ffmpeg_opts']
-        self.default_prefix = config['default_prefix']
-        self.queue_display_length = config['queue_display_length']
-        self.view_timeout = config['view_timeout']
-        self.dj_role_name = config['dj_role_name']
-        self.broken = config['broken']
+        self.doom_playlist = config.doom_playlist
+        self.ydl_opts = config.ydl_opts
+        self.ffmpeg_opts = config.ffmpeg_opts
+        self.default_prefix = config.default_prefix
+        self.queue_display_length = config.queue_display_length
+        self.view_timeout = config.view_timeout
+        self.dj_role_name = config.dj_role_name
+        self.broken = config.broken
+
+    def cog_unload(self) -> None:
+        """
+            Stops the guild players and resolver workers and saves the queues when the cog is unloaded
+
+        :return:    None
+        """
+        for player in self.queues.players.values():
+            player.stop()
+        self.queues.scheduler.stop()
+        self.queues.close_store()
+        self.resolver.shutdown()
 
     @commands.command(name='play',
                       help='Connects Bot to Voice',
                       aliases=['p'],
                       usage="<youtube/spotify/soundcloud song/playlist url, or keywords to search youtube>")
-    @commands.has_role(config['dj_role_name'])
-    async def play_(self, ctx: Context, *, link: str, song_info: Tuple[Any] = None, queue_position: int = None):
+    @commands.has_role(config.dj_role_name)
+    async def play_(self, ctx: Context, *, link: str, song_info: List[Song] = None, queue_position: int = None):
         """
             Command to connect to voice
                 plays song
@@ -58,14 +72,14 @@ class Commands(commands.Cog):
 
         :param ctx:             Command context: Context
         :param link:            Given link: str
-        :param song_info:       Bypass song search if song info is already available: Tuple
+        :param song_info:       Bypass song search if songs are already available: List[Song]
         :param queue_position:  Position to place song in queue: int
         :return:                None
         """
         try:
             await ctx.message.delete(delay=5)
         except nextcord.DiscordException:
-            if config['debug_mode']:
+            if config.debug_mode:
                 print('Commands.play | {}'.format(format_exc()))
         else:
             # Skip command if bot is broken
@@ -106,7 +120,7 @@ class Commands(commands.Cog):
                       help="Inserts song into queue to be played next",
                       aliases=['insert'],
                       usage="<youtube/spotify/soundcloud song/playlist url, or keywords to search youtube>")
-    @commands.has_role(config['dj_role_name'])
+    @commands.has_role(config.dj_role_name)
     async def play_next_(self, ctx: Context, *, link: str):
         """
             Calls play with a parameter to insert the song into the front of the queue
@@ -118,7 +132,7 @@ class Commands(commands.Cog):
         try:
             await ctx.message.delete(delay=5)
         except nextcord.DiscordException:
-            if config['debug_mode']:
+            if config.debug_mode:
                 print('Commands.play_next | {}'.format(format_exc()))
         else:
             # Skip command if bot is broken
@@ -132,7 +146,7 @@ class Commands(commands.Cog):
                       help='Skips to next Song in Queue, will remove song from queue in loop mode',
                       aliases=['s'],
                       usage="[number of songs to skip]")
-    @commands.has_role(config['dj_role_name'])
+    @commands.has_role(config.dj_role_name)
     async def skip_(self, ctx, num: int = 1):
         """
             Command to skip currently playing song
@@ -144,7 +158,7 @@ class Commands(commands.Cog):
         try:
             await ctx.message.delete(delay=5)
         except nextcord.DiscordException:
-            if config['debug_mode']:
+            if config.debug_mode:
                 print('Commands.skip | {}'.format(format_exc()))
         else:
             # Skip command if bot is broken
@@ -158,34 +172,14 @@ class Commands(commands.Cog):
                 print(f"Skip: Bot not connected to {ctx.guild.name}")
                 return await ctx.channel.send("Not in a Voice Channel", delete_after=10)
 
-            # Check that there is another song in the queue and the bot is currently playing
-            song_queue = self.queues.get_queue(ctx.guild.id)
-            if len(song_queue) > 1 and vc.is_playing():
-
-                # Pop currently playing off queue
-                if len(song_queue) >= num:
-                    del song_queue[0:num]
-                else:
-                    del song_queue[0]
-
-                # Update Voice Client source
-                # Replace yt searchable string in queue with yt_dl song info
-                song_url = self.utilities.get_first_in_queue(song_queue)
-                # Create FFmpeg audio stream, attach to voice client
-                vc.source = nextcord.FFmpegPCMAudio(song_url, **self.ffmpeg_opts)
-                vc.source = nextcord.PCMVolumeTransformer(vc.source)
-                vc.volume = 1
-
-                await ctx.channel.send("**Skipped a Song!**", delete_after=10)
-                await ctx.invoke(self.bot.get_command('np'))
-            else:
-                vc.stop()
-                await ctx.channel.send("**Skipped a Song!**", delete_after=10)
+            # Skip on the guild's player, it starts the next song and displays it
+            await self.queues.skip_songs(ctx.guild.id, num)
+            await ctx.channel.send("**Skipped a Song!**", delete_after=10)
 
     @commands.command(name='clear',
                       help='Clears the Song Queue',
                       usage='')
-    @commands.has_role(config['dj_role_name'])
+    @commands.has_role(config.dj_role_name)
     async def clear_(self, ctx: Context):
         """
             Command to clear server's Queue
@@ -196,7 +190,7 @@ class Commands(commands.Cog):
         try:
             await ctx.message.delete(delay=5)
         except nextcord.DiscordException:
-            if config['debug_mode']:
+            if config.debug_mode:
                 print('Commands.clear | {}'.format(format_exc()))
         else:
             # Skip command if bot is broken
@@ -205,7 +199,7 @@ class Commands(commands.Cog):
                 return
 
             # Empty the queue
-            self.queues.clear_queue(ctx.guild.id)
+            await self.queues.clear_queue(ctx.guild.id)
 
             # Send response
             await ctx.channel.send("**Cleared the Queue!**", delete_after=20)
@@ -223,7 +217,7 @@ class Commands(commands.Cog):
         try:
             await ctx.message.delete(delay=5)
         except nextcord.DiscordException:
-            if config['debug_mode']:
+            if config.debug_mode:
                 print('Commands.queue | {}'.format(format_exc()))
         else:
             # Skip command if bot is broken
@@ -233,7 +227,8 @@ class Commands(commands.Cog):
 
             song_queue = self.queues.get_queue(ctx.guild.id)
             if song_queue:
-                view = views.QueueView(self.bot, ctx, song_queue, self.view_timeout)
+                view = views.QueueView(self.bot, ctx, self.embeds, song_queue, self.view_timeout,
+                                       self.queues.scheduler)
                 await view.create_message()
                 await view.wait()
             else:
@@ -252,7 +247,7 @@ class Commands(commands.Cog):
         try:
             await ctx.message.delete(delay=5)
         except nextcord.DiscordException:
-            if config['debug_mode']:
+            if config.debug_mode:
                 print('Commands.now_playing | {}'.format(format_exc()))
         else:
             # Skip command if bot is broken
@@ -264,7 +259,7 @@ class Commands(commands.Cog):
             song_queue = self.queues.get_queue(ctx.guild.id)
             if vc and vc.is_playing():
                 now = datetime.now().strftime('%m/%d/%Y, %H:%M')
-                print(f"({now}) --Now Playing-- \"{song_queue[0][0]}\" in guild: {ctx.guild.name}")
+                print(f"({now}) --Now Playing-- \"{song_queue[0].title}\" in guild: {ctx.guild.name}")
                 await ctx.channel.send(embed=self.embeds.generate_np_embed(ctx, song_queue[0]))
             else:
                 print(f'NowPlaying: Not in a Voice Channel in {ctx.guild.name}')
@@ -273,7 +268,7 @@ class Commands(commands.Cog):
     @commands.command(name='pause',
                       help='Pauses currently playing song',
                       usage='')
-    @commands.has_role(config['dj_role_name'])
+    @commands.has_role(config.dj_role_name)
     async def pause_(self, ctx: Context):
         """
             Pauses music to be resumed later
@@ -284,7 +279,7 @@ class Commands(commands.Cog):
         try:
             await ctx.message.delete(delay=5)
         except nextcord.DiscordException:
-            if config['debug_mode']:
+            if config.debug_mode:
                 print('Commands.pause | {}'.format(format_exc()))
         else:
             # Skip command if bot is broken
@@ -308,7 +303,7 @@ class Commands(commands.Cog):
     @commands.command(name='resume',
                       help='Resumes currently playing song',
                       usage='')
-    @commands.has_role(config['dj_role_name'])
+    @commands.has_role(config.dj_role_name)
     async def resume_(self, ctx: Context):
         """
             Resumes paused music
@@ -319,7 +314,7 @@ class Commands(commands.Cog):
         try:
             await ctx.message.delete(delay=5)
         except nextcord.DiscordException:
-            if config['debug_mode']:
+            if config.debug_mode:
                 print('Commands.resume | {}'.format(format_exc()))
         else:
             # Skip command if bot is broken
@@ -343,7 +338,7 @@ class Commands(commands.Cog):
     @commands.command(name='disconnect',
                       help='Disconnects from Voice',
                       usage='')
-    @commands.has_role(config['dj_role_name'])
+    @commands.has_role(config.dj_role_name)
     async def disconnect_(self, ctx: Context):
         """
             Command to disconnect bot from voice
@@ -354,7 +349,7 @@ class Commands(commands.Cog):
         try:
             await ctx.message.delete(delay=5)
         except nextcord.DiscordException:
-            if config['debug_mode']:
+            if config.debug_mode:
                 print('Commands.disconnect | {}'.format(format_exc()))
         else:
             # Skip command if bot is broken
@@ -369,13 +364,12 @@ class Commands(commands.Cog):
                 await vc.disconnect(force=False)
 
             # Clear song queue
-            self.queues.clear_queue(ctx.guild.id)
+            await self.queues.clear_queue(ctx.guild.id)
 
             # Turn off song loop in guild settings
-            server_settings = config_obj.read_config("SERVER_SETTINGS")
-            server = server_settings[str(ctx.guild.id)]
+            server = await config_obj.get_guild_settings(ctx.guild.id)
             server['loop'] = False
-            config_obj.write_config('w', 'SERVER_SETTINGS', str(ctx.guild.id), server)
+            await config_obj.set_guild_settings(ctx.guild.id, server)
 
     @commands.command(name='prefix',
                       help='Displays or changes prefix for this server',
@@ -392,7 +386,7 @@ class Commands(commands.Cog):
         try:
             await ctx.message.delete(delay=5)
         except nextcord.DiscordException:
-            if config['debug_mode']:
+            if config.debug_mode:
                 print('Commands.prefix | {}'.format(format_exc()))
         else:
             # Skip command if bot is broken
@@ -405,16 +399,16 @@ class Commands(commands.Cog):
             # If a prefix was given, change the prefix, otherwise display the current prefix
             if prefix and len(prefix) < 2:
                 # Update config file
-                settings = config_obj.read_config('SERVER_SETTINGS')[str(ctx.guild.id)]
+                settings = await config_obj.get_guild_settings(ctx.guild.id)
                 settings['prefix'] = str(''.join(prefix))
-                config_obj.write_config('w', 'SERVER_SETTINGS', str(ctx.guild.id), settings)
+                await config_obj.set_guild_settings(ctx.guild.id, settings)
 
                 await ctx.channel.send(f"Prefix for {ctx.guild.name} has been changed to: "
-                                       f"{config_obj.read_config('SERVER_SETTINGS')[str(ctx.guild.id)]['prefix']}",
+                                       f"{(await config_obj.get_guild_settings(ctx.guild.id))['prefix']}",
                                        delete_after=10)
             else:
                 await ctx.channel.send(f"Prefix for {ctx.guild.name} is: "
-                                       f"{config_obj.read_config('SERVER_SETTINGS')[str(ctx.guild.id)]['prefix']}",
+                                       f"{(await config_obj.get_guild_settings(ctx.guild.id))['prefix']}",
                                        delete_after=10)
 
     @commands.command(name='invite',
@@ -430,7 +424,7 @@ class Commands(commands.Cog):
         try:
             await ctx.message.delete(delay=5)
         except nextcord.DiscordException:
-            if config['debug_mode']:
+            if config.debug_mode:
                 print('Commands.invite | {}'.format(format_exc()))
         else:
             # Skip command if bot is broken
@@ -443,7 +437,7 @@ class Commands(commands.Cog):
     @commands.command(name='search',
                       help=f'Searches with given keywords, displays top results',
                       usage="<keywords to search>")
-    @commands.has_role(config['dj_role_name'])
+    @commands.has_role(config.dj_role_name)
     async def search(self, ctx: Context, *, keywords: str):
         """
             Searches Youtube for given keywords, displays the top 'x' results, allows user to select from list with
@@ -458,7 +452,7 @@ class Commands(commands.Cog):
         try:
             await ctx.message.delete(delay=5)
         except nextcord.DiscordException:
-            if config['debug_mode']:
+            if config.debug_mode:
                 print('Commands.search | {}'.format(format_exc()))
         else:
             # Skip command if bot is broken
@@ -466,8 +460,8 @@ class Commands(commands.Cog):
                 await self.broken_(ctx)
                 return
 
-            search = SongSearch()
-            view = views.SearchView()
+            search = SongSearch(config)
+            view = views.SearchView(config)
 
             results = search.search_yt(keywords)
 
@@ -484,7 +478,7 @@ class Commands(commands.Cog):
     @commands.command(name='shuffle',
                       help='Shuffles the queue',
                       usage='')
-    @commands.has_role(config['dj_role_name'])
+    @commands.has_role(config.dj_role_name)
     async def shuffle_(self, ctx: Context):
         """
             Shuffles the server song queue
@@ -495,7 +489,7 @@ class Commands(commands.Cog):
         try:
             await ctx.message.delete(delay=5)
         except nextcord.DiscordException:
-            if config['debug_mode']:
+            if config.debug_mode:
                 print('Commands.shuffle | {}'.format(format_exc()))
         else:
             # Skip command if bot is broken
@@ -505,12 +499,8 @@ class Commands(commands.Cog):
 
             song_queue = self.queues.get_queue(ctx.guild.id)
             if len(song_queue) > 1:
-                # store current song
-                temp_song = song_queue[0]
-                del song_queue[0]
-
-                random.shuffle(song_queue)
-                song_queue.insert(0, temp_song)  # add current song back into queue
+                # Shuffle everything after the current song
+                await self.queues.shuffle_queue(ctx.guild.id)
 
                 await ctx.channel.send(f"**Shuffled the Queue!**", delete_after=10)
                 await ctx.invoke(self.bot.get_command('queue'))
@@ -520,7 +510,7 @@ class Commands(commands.Cog):
     @commands.command(name='remove',
                       help='Removes a specific song from the queue',
                       usage='<number of song in queue>')
-    @commands.has_role(config['dj_role_name'])
+    @commands.has_role(config.dj_role_name)
     async def remove_song_(self, ctx: Context, num: int):
         """
             Removes a specific song from the queue
@@ -532,7 +522,7 @@ class Commands(commands.Cog):
         try:
             await ctx.message.delete(delay=5)
         except nextcord.DiscordException:
-            if config['debug_mode']:
+            if config.debug_mode:
                 print('Commands.remove_song | {}'.format(format_exc()))
         else:
             # Skip command if bot is broken
@@ -549,7 +539,8 @@ class Commands(commands.Cog):
                 is_timeout = await view.wait()
                 if not is_timeout:
                     if view.value:
-                        song_queue.pop(num - 1)
+                        # The queue may have moved on while confirming, remove the song itself
+                        await self.queues.remove_song(ctx.guild.id, pending_song)
                         await ctx.channel.send("**Song Deleted!**", delete_after=10)
 
                     else:
@@ -560,7 +551,7 @@ class Commands(commands.Cog):
     @commands.command(name='loop',
                       help='Toggles loop mode for the song queue',
                       usage='')
-    @commands.has_role(config['dj_role_name'])
+    @commands.has_role(config.dj_role_name)
     async def loop_(self, ctx: Context):
         """
             Toggles the loop function of the song queue,
@@ -572,7 +563,7 @@ class Commands(commands.Cog):
         try:
             await ctx.message.delete(delay=5)
         except nextcord.DiscordException:
-            if config['debug_mode']:
+            if config.debug_mode:
                 print('Commands.loop | {}'.format(format_exc()))
         else:
             # Skip command if bot is broken
@@ -580,8 +571,7 @@ class Commands(commands.Cog):
                 await self.broken_(ctx)
                 return
 
-            server_settings = config_obj.read_config("SERVER_SETTINGS")
-            server = server_settings[str(ctx.guild.id)]
+            server = await config_obj.get_guild_settings(ctx.guild.id)
 
             # Toggle server loop setting
             if server['loop']:
@@ -591,12 +581,12 @@ class Commands(commands.Cog):
                 server['loop'] = True
 
             await ctx.channel.send(embed=self.embeds.generate_loop_embed(ctx, server['loop']), delete_after=10)
-            config_obj.write_config('w', 'SERVER_SETTINGS', str(ctx.guild.id), server)
+            await config_obj.set_guild_settings(ctx.guild.id, server)
 
     @commands.command(name='mix',
                       help='Searches for an artist and queues their songs',
                       usage='<artist name>')
-    @commands.has_role(config['dj_role_name'])
+    @commands.has_role(config.dj_role_name)
     async def mix_(self, ctx: Context, *, artist_name: str):
         """
             Builds a playlist from all available songs by an artist from spotify
@@ -608,7 +598,7 @@ class Commands(commands.Cog):
         try:
             await ctx.message.delete(delay=5)
         except nextcord.DiscordException:
-            if config['debug_mode']:
+            if config.debug_mode:
                 print('Commands.mix | {}'.format(format_exc()))
         else:
             # Skip command if bot is broken
@@ -616,9 +606,9 @@ class Commands(commands.Cog):
                 await self.broken_(ctx)
                 return
 
-            search = SpotifyParser(ctx.message.author)
+            search = SpotifyParser(ctx.message.author, self.utilities)
 
-            view = views.SearchView()
+            view = views.SearchView(config)
             artists = search.artist_search(artist_name)
             message = await ctx.channel.send(embed=self.embeds.generate_mix_embed(ctx, artists),
                                              view=view)
@@ -633,7 +623,7 @@ class Commands(commands.Cog):
     @commands.command(name='doom',
                       help='Rip and Tear, until it is done...',
                       usage='')
-    @commands.has_role(config['dj_role_name'])
+    @commands.has_role(config.dj_role_name)
     async def doom_(self, ctx: Context):
         """
             Loops music from the DOOM game indefinitely
@@ -644,7 +634,7 @@ class Commands(commands.Cog):
         try:
             await ctx.message.delete(delay=5)
         except nextcord.DiscordException:
-            if config['debug_mode']:
+            if config.debug_mode:
                 print('Commands.doom | {}'.format(format_exc()))
         else:
             # Skip command if bot is broken
@@ -677,13 +667,12 @@ class Commands(commands.Cog):
                 # Shuffle queue
                 song_queue = self.queues.get_queue(ctx.guild.id)
                 if len(song_queue) > 1:
-                    random.shuffle(song_queue)
+                    await self.queues.shuffle_queue(ctx.guild.id, start=0)
 
                 # Toggle server loop setting
-                server_settings = config_obj.read_config("SERVER_SETTINGS")
-                server = server_settings[str(ctx.guild.id)]
+                server = await config_obj.get_guild_settings(ctx.guild.id)
                 server['loop'] = True
-                config_obj.write_config('w', 'SERVER_SETTINGS', str(ctx.guild.id), server)
+                await config_obj.set_guild_settings(ctx.guild.id, server)
 
                 # Play song if not playing a song
                 if not vc.is_playing():
@@ -696,7 +685,7 @@ class Commands(commands.Cog):
         try:
             await ctx.message.delete(delay=5)
         except nextcord.DiscordException:
-            if config['debug_mode']:
+            if config.debug_mode:
                 print('Commands.lyrics | {}'.format(format_exc()))
         else:
             # Skip command if bot is broken
@@ -711,7 +700,7 @@ class Commands(commands.Cog):
             parser = LyricsParser()
             lyrics = parser.get_lyrics_list(title, artist)
 
-            view = views.LyricsView(self.bot, ctx, lyrics, title, artist, self.view_timeout)
+            view = views.LyricsView(self.bot, ctx, self.embeds, lyrics, title, artist, self.view_timeout)
             await view.create_message()
             await view.wait()
 
@@ -726,7 +715,7 @@ class Commands(commands.Cog):
         try:
             await ctx.message.delete(delay=5)
         except nextcord.DiscordException:
-            if config['debug_mode']:
+            if config.debug_mode:
                 print('Commands.help | {}'.format(format_exc()))
         else:
             # Skip command if bot is broken
@@ -734,7 +723,7 @@ class Commands(commands.Cog):
                 await self.broken_(ctx)
                 return
 
-            view = views.HelpView(self.bot, ctx, self.view_timeout)
+            view = views.HelpView(self.bot, ctx, self.embeds, self.view_timeout)
             await view.create_message()
             await view.wait()
 
@@ -799,7 +788,7 @@ class Commands(commands.Cog):
             try:
                 await ctx.channel.send(f'command: {ctx.command} can not be used in Private Messages!')
             except nextcord.HTTPException:
-                if config['debug_mode']:
+                if config.debug_mode:
                     print('Commands.error | {}'.format(format_exc()))
 
         elif isinstance(error, (commands.BadArgument, commands.MissingRequiredArgument)):
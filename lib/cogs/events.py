@@ -5,8 +5,7 @@ import nextcord
 from nextcord import Member, Guild, VoiceState
 from nextcord.ext import commands
 from nextcord.ext.commands import Bot
-from lib.helpers.Utils import Util, ConfigUtil
-from lib.helpers.Embeds import Embeds
+from lib.helpers.Utils import ConfigUtil
 from traceback import format_exc
 
 
@@ -17,13 +16,12 @@ class Events(commands.Cog):
 
     def __init__(self, bot: Bot):
         self.bot = bot
-        self.default_prefix = "~"
-        self.embeds = Embeds(bot)
-        self.utilities = Util()
         self.config_obj = ConfigUtil()
-        self.config_obj = ConfigUtil()
-        self.config = self.config_obj.read_config('BOT_SETTINGS')
+        self.config = self.config_obj.get_bot_settings()
+        self.default_prefix = self.config.default_prefix
         self.command_cog = bot.get_cog("Commands")
+        self.embeds = self.command_cog.embeds
+        self.utilities = self.command_cog.utilities
 
     @commands.Cog.listener()
     async def on_voice_state_update(self, member: Member, before: VoiceState, after: VoiceState):
@@ -48,16 +46,15 @@ class Events(commands.Cog):
                     await member.guild.voice_client.disconnect(force=False)
 
                     # Clear server song queue
-                    self.command_cog.queues.clear_queue(member.guild.id)
+                    await self.command_cog.queues.clear_queue(member.guild.id)
 
                     # Turn off song loop in guild
-                    server_settings = self.config_obj.read_config("SERVER_SETTINGS")
-                    server = server_settings[str(member.guild.id)]
+                    server = await self.config_obj.get_guild_settings(member.guild.id)
                     server['loop'] = False
-                    self.config_obj.write_config('w', 'SERVER_SETTINGS', str(member.guild.id), server)
+                    await self.config_obj.set_guild_settings(member.guild.id, server)
 
         except AttributeError:
-            if self.config['debug_mode']:
+            if self.config.debug_mode:
                 print('Util.repopulate_queue | {}'.format(format_exc()))
 
     @commands.Cog.listener()
@@ -70,7 +67,7 @@ class Events(commands.Cog):
         """
         # Set prefix of new server to default prefix and loop toggle
         default = {"prefix": self.default_prefix, "loop": False}
-        self.config_obj.write_config('w', "SERVER_SETTINGS", str(guild.id), default)
+        await self.config_obj.set_guild_settings(guild.id, default)
 
         # Update server queues
         self.command_cog.queues.create_server_queue()
@@ -94,7 +91,7 @@ class Events(commands.Cog):
         :return:        None
         """
         # remove server's prefix from config
-        self.config_obj.write_config('d', "SERVER_SETTINGS", str(guild.id))
+        await self.config_obj.delete_guild_settings(guild.id)
 
         # Update server queues
         self.command_cog.queues.create_server_queue()
@@ -4,40 +4,67 @@ import nextcord
 
 from nextcord.ext import commands, tasks
 from nextcord.ext.commands import Bot
-from lib.helpers.Utils import Util
-from lib.helpers.Utils import ConfigUtil
-from traceback import format_exc
+from lib.helpers.Utils import ConfigUtil, Util
+from lib.helpers.DBMetrics import db_metrics
 
 
 class Tasks(commands.Cog):
     def __init__(self, bot: Bot):
         self.bot = bot
-        self.utilities = Util()
         self.commands = bot.get_cog("Commands")
+        self.utilities = self.commands.utilities
         self.config_obj = ConfigUtil()
-        self.config = self.config_obj.read_config('BOT_SETTINGS')
+        self.config = self.config_obj.get_bot_settings()
 
         self.start_tasks()
 
-    @tasks.loop(seconds=20)
-    async def update_queues(self) -> None:
+    @tasks.loop(seconds=0.5)
+    async def flush_settings(self) -> None:
         """
-            Background task to update server queues that have non-YouTube sourced songs
+            Background task to write pending guild settings changes to the DB
+                Also retries the start-up reconcile if the DB was unreachable then
 
         :return:    None
         """
-        try:
-            for guild in self.bot.guilds:
-                server_queue = self.commands.queues.get_queue(guild.id)
-                for song in server_queue:
-                    if len(song) == 2:  # Song is from non-youtube source
-                        await self.utilities.repopulate_queue(server_queue)
-                        break
-        except IndexError or ValueError:
-            if self.config['debug_mode']:
-                print('Util.repopulate_queue | {}'.format(format_exc()))
-
-    @update_queues.before_loop
+        await self.config_obj.flush_guild_settings()
+        await self.config_obj.retry_reconcile()
+
+    @tasks.loop(seconds=5)
+    async def save_queues(self) -> None:
+        """
+            Background task to snapshot changed song queues to the queue store
+
+        :return:    None
+        """
+        await self.commands.queues.save_queues()
+
+    @save_queues.before_loop
+    async def restore_queues(self) -> None:
+        """
+            Restores stored song queues once the bot is ready, before the first snapshot can overwrite them
+
+        :return:    None
+        """
+        await self.bot.wait_until_ready()
+        await self.commands.queues.restore_queues()
+
+    @tasks.loop(minutes=10)
+    async def log_db_metrics(self) -> None:
+        """
+            Background task to print a summary of settings DB and query index usage
+
+        :return:    None
+        """
+        rows = db_metrics.summary()
+        if rows:
+            print("\tSettings DB usage:")
+            Util.display_table(rows, ['Query', 'Call Site', 'Calls', 'Avg ms', 'p95 ms', 'Max ms'])
+        if self.utilities.resolver.index:
+            stats = await self.bot.loop.run_in_executor(None, self.utilities.resolver.index.stats)
+            print("\tQuery index: {entries} entries, {hits} hits, {misses} misses ({hit_rate:.1%} hit rate)"
+                  .format(**stats))
+
+    @log_db_metrics.before_loop
     async def wait_until_login(self) -> None:
         """
             Blocks tasks from beginning before bot has finished logging in
@@ -52,7 +79,24 @@ class Tasks(commands.Cog):
 
         :return:    None
         """
-        self.update_queues.start()
+        self.flush_settings.change_interval(seconds=self.config_obj.flush_interval())
+        self.flush_settings.start()
+        self.save_queues.change_interval(seconds=self.config_obj.app_settings().get('QueueStore', {})
+                                         .get('interval', 5))
+        self.save_queues.start()
+        self.log_db_metrics.change_interval(minutes=self.config_obj.app_settings().get('Metrics', {})
+                                            .get('log_interval_minutes', 10))
+        self.log_db_metrics.start()
+
+    def cog_unload(self) -> None:
+        """
+            Stops background tasks when the cog is unloaded
+
+        :return:    None
+        """
+        self.flush_settings.cancel()
+        self.save_queues.cancel()
+        self.log_db_metrics.cancel()
 
 
 def setup(bot: Bot):
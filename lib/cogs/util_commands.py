@@ -6,6 +6,8 @@ from nextcord.ext.commands import Context, Bot
 from lib.helpers.Utils import ConfigUtil
 from lib.ui import views
 from lib.helpers.Embeds import Embeds
+from lib.helpers.DBMetrics import db_metrics
+from datetime import datetime
 from traceback import format_exc
 
 class UtilCommands(commands.Cog):
@@ -15,11 +17,10 @@ class UtilCommands(commands.Cog):
 
     def __init__(self, bot: Bot):
         self.bot = bot
-        self.embeds = Embeds(bot)
-
         self.config_obj = ConfigUtil()
-        self.config = self.config_obj.read_config('BOT_SETTINGS')
-        self.view_timeout = self.config['view_timeout']
+        self.config = self.config_obj.get_bot_settings()
+        self.embeds = Embeds(bot, self.config)
+        self.view_timeout = self.config.view_timeout
 
     @commands.command(name='purge',
                       help='Cleans messages from specified user in current channel',
@@ -39,7 +40,7 @@ class UtilCommands(commands.Cog):
         try:
             await ctx.message.delete(delay=1)
         except nextcord.DiscordException:
-            if self.config['debug_mode']:
+            if self.config.debug_mode:
                 print('Util.repopulate_queue | {}'.format(format_exc()))
 
         if user != "":
@@ -71,6 +72,31 @@ class UtilCommands(commands.Cog):
         else:
             await ctx.channel.send("**Canceled Message Purge**", delete_after=5)
 
+    @commands.command(name='dbstats',
+                      help='Shows settings DB call counts and latency per command',
+                      usage="[reset]")
+    @commands.has_permissions(administrator=True)
+    async def db_stats_(self, ctx: Context, action: str = ""):
+        """
+            Displays settings DB instrumentation, optionally resets it
+
+        :param ctx:     Discord message context: Context
+        :param action:  'reset' to clear recorded stats: str
+        :return:        None
+        """
+        try:
+            await ctx.message.delete(delay=5)
+        except nextcord.DiscordException:
+            if self.config.debug_mode:
+                print('UtilCommands.db_stats | {}'.format(format_exc()))
+
+        since = datetime.fromtimestamp(db_metrics.started).strftime('%m/%d/%Y, %H:%M')
+        await ctx.channel.send(embed=self.embeds.generate_db_stats_embed(ctx, db_metrics.summary(), since),
+                               delete_after=60)
+        if action.lower() == 'reset':
+            db_metrics.reset()
+            await ctx.channel.send("**Reset settings DB stats!**", delete_after=10)
+
 
 def setup(bot: Bot):
     # Required Function for Cog loading
@@ -0,0 +1,46 @@
+# BotSettings.py
+
+from dataclasses import dataclass
+from types import MappingProxyType
+from typing import Mapping, Any
+
+
+@dataclass(frozen=True, slots=True)
+class BotSettings:
+    """
+        Immutable bot wide settings, loaded once from the "primary-config" table at start-up
+
+        Shared by every cog, view and helper instead of each of them querying the DB
+    """
+    invite_link: str
+    doom_playlist: str
+    ydl_opts: Mapping[str, Any]
+    ffmpeg_opts: Mapping[str, Any]
+    embed_theme: int
+    queue_display_length: int
+    default_prefix: str
+    view_timeout: int
+    dj_role_name: str
+    broken: bool
+    debug_mode: bool
+
+    @classmethod
+    def from_dict(cls, settings: dict) -> 'BotSettings':
+        """
+            Builds settings from a BOT_SETTINGS row
+                Option dicts are wrapped read-only, copy them before handing them to libraries that modify them
+
+        :param settings:    BOT_SETTINGS dict from ConfigUtil: dict
+        :return:            bot settings: BotSettings
+        """
+        return cls(invite_link=settings['invite_link'],
+                   doom_playlist=settings['doom_playlist'],
+                   ydl_opts=MappingProxyType(dict(settings['ydl_opts'])),
+                   ffmpeg_opts=MappingProxyType(dict(settings['ffmpeg_opts'])),
+                   embed_theme=settings['embed_theme'],
+                   queue_display_length=settings['queue_display_length'],
+                   default_prefix=settings['default_prefix'],
+                   view_timeout=settings['view_timeout'],
+                   dj_role_name=settings['dj_role_name'],
+                   broken=settings['broken'],
+                   debug_mode=settings['debug_mode'])
@@ -0,0 +1,158 @@
+# ConnectionPool.py
+
+import queue
+import threading
+import time
+
+from contextlib import contextmanager
+from typing import Callable, Iterator
+from rebel import Database
+
+
+class PoolTimeout(Exception):
+    """
+        Raised when no connection could be borrowed from the pool in time
+    """
+
+
+class ConnectionPool:
+    """
+        Bounded pool of reusable DB connections
+
+        Connections are created lazily up to `size`, handed out through `connection()` and returned to the pool
+        afterwards. Connections that sat idle longer than `health_check_interval` are checked before reuse,
+        broken connections are dropped and replaced.
+    """
+
+    def __init__(self, factory: Callable[[], Database], size: int = 4, timeout: float = 10,
+                 health_check_interval: float = 30):
+        """
+        :param factory:                 creates a new unconnected Database: Callable[[], Database]
+        :param size:                    max number of open connections: int
+        :param timeout:                 seconds to wait for a free connection: float
+        :param health_check_interval:   seconds a connection can sit idle before being checked: float
+        """
+        self.factory = factory
+        self.size = max(1, size)
+        self.timeout = timeout
+        self.health_check_interval = health_check_interval
+
+        # (Database, time returned to pool), most recently used first
+        self._idle = queue.LifoQueue(maxsize=self.size)
+        self._created = 0
+        self._lock = threading.Lock()
+        self._closed = False
+
+    @contextmanager
+    def connection(self) -> Iterator[Database]:
+        """
+            Borrow a connection from the pool, returned automatically on exit
+                Connections that raised an error are discarded instead of returned
+
+        :return:    Database connection: Iterator[Database]
+        """
+        db = self._acquire()
+        try:
+            yield db
+        except BaseException:
+            self._discard(db)
+            raise
+        else:
+            self._release(db)
+
+    def close(self) -> None:
+        """
+            Closes all idle connections, borrowed connections are closed when returned
+
+        :return:    None
+        """
+        self._closed = True
+        while True:
+            try:
+                db, _ = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(db)
+
+    def _acquire(self) -> Database:
+        """
+            Get an idle connection, open a new one if under the size limit, otherwise wait for one to be returned
+
+        :return:    healthy Database connection: Database
+        """
+        if self._closed:
+            raise PoolTimeout('Connection pool is closed')
+
+        while True:
+            try:
+                db, last_used = self._idle.get_nowait()
+            except queue.Empty:
+                with self._lock:
+                    can_create = self._created < self.size
+                    if can_create:
+                        self._created += 1
+                if can_create:
+                    return self._new_connection()
+                try:
+                    db, last_used = self._idle.get(timeout=self.timeout)
+                except queue.Empty:
+                    raise PoolTimeout(f'No DB connection available after {self.timeout}s')
+
+            if time.monotonic() - last_used < self.health_check_interval or self._is_healthy(db):
+                return db
+            self._discard(db)
+
+    def _new_connection(self) -> Database:
+        """
+            Opens a new connection, releases the reserved pool slot on failure
+
+        :return:    connected Database: Database
+        """
+        try:
+            db = self.factory()
+            db.query_value('SELECT 1')
+            return db
+        except BaseException:
+            with self._lock:
+                self._created -= 1
+            raise
+
+    def _release(self, db: Database) -> None:
+        """
+            Return a connection to the pool
+
+        :param db:  borrowed connection: Database
+        :return:    None
+        """
+        if self._closed or db.transaction_depth:
+            self._discard(db)
+            return
+        self._idle.put_nowait((db, time.monotonic()))
+
+    def _discard(self, db: Database) -> None:
+        """
+            Close a connection and free its pool slot
+
+        :param db:  connection to drop: Database
+        :return:    None
+        """
+        with self._lock:
+            self._created -= 1
+        try:
+            if db.connected:
+                db.driver.connection.close()
+        except Exception:
+            pass
+
+    @staticmethod
+    def _is_healthy(db: Database) -> bool:
+        """
+            Checks that a connection is still usable
+
+        :param db:  connection to check: Database
+        :return:    connection health: bool
+        """
+        try:
+            return db.query_value('SELECT 1') == 1
+        except Exception:
+            return False
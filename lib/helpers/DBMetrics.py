@@ -0,0 +1,142 @@
+# DBMetrics.py
+
+import functools
+import os
+import sys
+import threading
+import time
+
+from contextvars import ContextVar
+from typing import Callable, List, Tuple, Optional
+
+# Command (or cog listener/task) that caused the current DB call, set by the bot's before_invoke hook
+current_call_site: ContextVar[Optional[str]] = ContextVar('current_call_site', default=None)
+
+_LIB_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+_PROJECT_ROOT = os.path.dirname(_LIB_ROOT)
+
+
+class DBMetrics:
+    """
+        Records call count and latency of settings I/O per query kind and call site
+
+        Call sites come from `current_call_site` when a command is running, otherwise from the first caller in the
+        stack that lives outside the settings helpers (cog listeners, tasks, start-up)
+    """
+
+    # Latency histogram bucket upper bounds in ms, the last bucket catches everything slower
+    BUCKETS_MS = (1, 5, 10, 25, 50, 100, 250, 500, 1000)
+
+    # Files whose frames are skipped when looking for the caller
+    _INTERNAL_FILES = ('Utils.py', 'DBMetrics.py', 'SettingsStore.py', 'ConnectionPool.py')
+
+    def __init__(self):
+        # {(kind, call site): [count, total ms, max ms, bucket counts]}
+        self._stats = {}
+        self._lock = threading.Lock()
+        self.started = time.time()
+
+    def record(self, kind: str, call_site: str, elapsed_ms: float) -> None:
+        """
+            Adds one call to the stats
+
+        :param kind:        query kind: str
+        :param call_site:   calling command/cog: str
+        :param elapsed_ms:  call latency in ms: float
+        :return:            None
+        """
+        bucket = next((i for i, bound in enumerate(self.BUCKETS_MS) if elapsed_ms <= bound), len(self.BUCKETS_MS))
+        with self._lock:
+            stat = self._stats.get((kind, call_site))
+            if stat is None:
+                stat = self._stats[(kind, call_site)] = [0, 0.0, 0.0, [0] * (len(self.BUCKETS_MS) + 1)]
+            stat[0] += 1
+            stat[1] += elapsed_ms
+            stat[2] = max(stat[2], elapsed_ms)
+            stat[3][bucket] += 1
+
+    def instrument(self, name: str, field_arg: bool = False) -> Callable:
+        """
+            Decorator recording every call of a settings function
+
+        :param name:        query kind name: str
+        :param field_arg:   append the first argument (the settings field) to the kind: bool
+        :return:            decorator: Callable
+        """
+        def decorator(func: Callable) -> Callable:
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                kind = f'{name}:{args[0]}' if field_arg and args else name
+                call_site = self.call_site()
+                start = time.perf_counter()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    self.record(kind, call_site, (time.perf_counter() - start) * 1000)
+            return wrapper
+        return decorator
+
+    def call_site(self) -> str:
+        """
+            Finds what caused the current settings call
+
+        :return:    "Cog.command" or "Class.function" of the caller: str
+        """
+        call_site = current_call_site.get()
+        if call_site:
+            return call_site
+
+        frame = sys._getframe(1)
+        while frame is not None:
+            filename = frame.f_code.co_filename
+            if filename.startswith(_PROJECT_ROOT) and not filename.endswith(self._INTERNAL_FILES):
+                return frame.f_code.co_qualname
+            frame = frame.f_back
+        return 'unknown'
+
+    def summary(self) -> List[Tuple[str, str, int, float, float, float]]:
+        """
+            Summarizes recorded calls, busiest first
+
+        :return:    list(tuple(kind, call site, count, avg ms, p95 ms, max ms))
+        """
+        with self._lock:
+            stats = [(kind, site, stat[0], stat[1], stat[2], list(stat[3]))
+                     for (kind, site), stat in self._stats.items()]
+
+        rows = []
+        for kind, site, count, total, max_ms, buckets in stats:
+            rows.append((kind, site, count, round(total / count, 2), self._percentile(buckets, count, 0.95, max_ms),
+                         round(max_ms, 2)))
+        return sorted(rows, key=lambda row: row[2] * row[3], reverse=True)
+
+    def reset(self) -> None:
+        """
+            Clears all recorded calls
+
+        :return:    None
+        """
+        with self._lock:
+            self._stats.clear()
+            self.started = time.time()
+
+    def _percentile(self, buckets: List[int], count: int, percentile: float, max_ms: float) -> float:
+        """
+            Estimates a latency percentile from histogram buckets (bucket upper bound)
+
+        :param buckets:     bucket counts: List[int]
+        :param count:       total calls: int
+        :param percentile:  0-1: float
+        :param max_ms:      slowest call, used for the overflow bucket: float
+        :return:            latency in ms: float
+        """
+        seen = 0
+        for i, bucket_count in enumerate(buckets):
+            seen += bucket_count
+            if seen >= count * percentile:
+                return min(self.BUCKETS_MS[i], round(max_ms, 2)) if i < len(self.BUCKETS_MS) else round(max_ms, 2)
+        return round(max_ms, 2)
+
+
+# Shared by all settings helpers for the life of the process
+db_metrics = DBMetrics()
@@ -7,6 +7,9 @@ from nextcord import Embed, Guild
 from nextcord.ext.commands import Context
 from lib.helpers.Utils import ConfigUtil
 from lib.helpers.Utils import Util
+from lib.helpers.BotSettings import BotSettings
+from lib.helpers.Song import Song
+from lib.helpers.GuildQueue import GuildQueue
 
 
 class Embeds:
@@ -14,49 +17,48 @@ class Embeds:
         Embed functions for music bot
     """
 
-    def __init__(self, bot):
+    def __init__(self, bot, settings: BotSettings):
         self.bot = bot
         self.config = ConfigUtil()
-        self.utilities = Util()
 
         # Get config values
-        bot_settings = self.config.read_config('BOT_SETTINGS')
-        self.invite_link = bot_settings['invite_link']
-        self.embed_theme = bot_settings['embed_theme']
-        self.queue_display_length = bot_settings['queue_display_length']
-        self.default_prefix = bot_settings['default_prefix']
+        self.invite_link = settings.invite_link
+        self.embed_theme = settings.embed_theme
+        self.queue_display_length = settings.queue_display_length
+        self.default_prefix = settings.default_prefix
 
-    def generate_np_embed(self, ctx: Context, song: tuple) -> Embed:
+    def generate_np_embed(self, ctx: Context, song: Song) -> Embed:
         """
             Generates embed for "Now Playing" messages
 
         :param ctx:     context command was invoked under: Context
-        :param song:    (song_title, playback_url, webpage_url, author of request, duration, thumbnail): tuple
+        :param song:    resolved song: Song
         :return:        nextcord Embed: Embed
         """
         embed = Embed(title="Now Playing", color=self.embed_theme)
         embed.set_thumbnail(url=self.bot.user.display_avatar)
-        embed.set_image(url=song[5])
+        embed.set_image(url=song.thumbnail)
         embed.add_field(name="Song: ",
-                        value=f"[{song[0]}]({song[2]})\n"
-                              f"Duration - {math.floor(song[4] / 60)}:{str(math.floor(song[4] % 60)).rjust(2, '0')}",
+                        value=f"[{song.title}]({song.webpage_url})\n"
+                              f"Duration - {math.floor(song.duration / 60)}:"
+                              f"{str(math.floor(song.duration % 60)).rjust(2, '0')}",
                         inline=False)
-        embed.set_footer(text=f"Requested by {song[3].name}", icon_url=song[3].display_avatar)
+        embed.set_footer(text=f"Requested by {song.author.name}", icon_url=song.author.display_avatar)
         return embed
 
-    def generate_added_queue_embed(self, ctx: Context, song: Union[list, tuple]) -> Embed:
+    def generate_added_queue_embed(self, ctx: Context, song: Union[List[Song], Song]) -> Embed:
         """
             Generates embed for "Added to Queue" messages
 
         :param ctx:     context command was invoked under: Context
-        :param song:    (song_title, playback_url, webpage_url, author of request, duration, thumbnail): tuple
+        :param song:    song / list of songs: Union[List[Song], Song]
         :return:        nextcord Embed: Embed
         """
         embed = Embed(title="Added to Queue", color=self.embed_theme)
         embed.set_thumbnail(url=self.bot.user.display_avatar)
-        if type(song) == tuple:
-            embed.add_field(name="Song: ", value=f"[{song[0]}]({song[2]})", inline=False)
-            embed.set_footer(text=f"Requested by {song[3].name}", icon_url=song[3].display_avatar)
+        if isinstance(song, Song):
+            embed.add_field(name="Song: ", value=f"[{song.title}]({song.webpage_url})", inline=False)
+            embed.set_footer(text=f"Requested by {song.author.name}", icon_url=song.author.display_avatar)
         else:
             overflow = False
             for count, i in enumerate(song):
@@ -64,52 +66,52 @@ class Embeds:
                 if count == self.queue_display_length:
                     overflow = True
                     break
-                # Embed link if song info is from youtube
-                if len(i) == 2:
-                    embed.add_field(name=f"{count + 1}: ", value=f"{i[0]}", inline=False)
+                # Embed link if song is resolved
+                if not i.resolved:
+                    embed.add_field(name=f"{count + 1}: ", value=f"{i.display_title}", inline=False)
                 else:
-                    embed.add_field(name=f"{count + 1}: ", value=f"[{i[0]}]({i[2]})", inline=False)
+                    embed.add_field(name=f"{count + 1}: ", value=f"[{i.title}]({i.webpage_url})", inline=False)
             if overflow:
                 embed.set_footer(text=f"+{len(song) - self.queue_display_length} more")
             else:
-                embed.set_footer(text=f"Requested by {song[0][3].name}", icon_url=song[0][3].display_avatar)
+                embed.set_footer(text=f"Requested by {song[0].author.name}", icon_url=song[0].author.display_avatar)
         return embed
 
-    def generate_display_queue(self, ctx: Context, queue: List[tuple], page: int) -> Tuple[Embed, int]:
+    def generate_display_queue(self, ctx: Context, queue: GuildQueue, page: int) -> Tuple[Embed, int]:
         """
             Generates embed for "Queue" messages
 
         :param ctx:     context command was invoked under: Context
-        :param queue:   Server queue list: List[tuple]
+        :param queue:   Server song queue: GuildQueue
         :param page:    page of queue to display: int
         :return:        nextcord Embed, number of pages: Tuple[Embed, int]
         """
         embed = Embed(title="Queue", color=self.embed_theme)
         embed.set_thumbnail(url=self.bot.user.display_avatar)
-        # Break queue into pages of length `queue_display_length`
-        queue_pages = [queue[i:i + self.queue_display_length]
-                       for i in range(0, len(queue), self.queue_display_length)]
+        # Pages of length `queue_display_length`, only the displayed one is sliced out of the queue
+        num_pages = math.ceil(len(queue) / self.queue_display_length)
+        queue_page = queue[page * self.queue_display_length:(page + 1) * self.queue_display_length]
 
         # Build message to display
-        for count, song in enumerate(queue_pages[page]):
-            # Embed link if song info is from youtube
+        for count, song in enumerate(queue_page):
+            # Embed link if song is resolved
             song_num = count + 1 + (1 * (page * self.queue_display_length))
-            if len(song) == 2:
+            if not song.resolved:
                 embed.add_field(name=f"{song_num}: ",
-                                value=f"{song[0]}",
+                                value=f"{song.display_title}",
                                 inline=False)
             else:
                 embed.add_field(name=f"{song_num}: ",
-                                value=f"[{song[0]}]({song[2]})",
+                                value=f"[{song.title}]({song.webpage_url})",
                                 inline=False)
 
-        embed.set_footer(text=f'Page {page + 1}/{len(queue_pages)} '
+        embed.set_footer(text=f'Page {page + 1}/{num_pages} '
                               f'--- '
                               f'{len(queue)} songs '
                               f'--- '
-                              f'Total Duration: {self.utilities.calculate_duration(queue)}')
+                              f'Total Duration: {Util.calculate_duration(queue)}')
 
-        return embed, len(queue_pages)
+        return embed, num_pages
 
     def generate_invite(self, ctx: Context) -> Embed:
         """
@@ -216,26 +218,25 @@ class Embeds:
 
         return embed
 
-    def generate_remove_embed(self, ctx: Context, song: tuple) -> Embed:
+    def generate_remove_embed(self, ctx: Context, song: Song) -> Embed:
         """
             Generates the embed to display a removed song from the queue
 
         :param ctx:     context command was invoked under: Context
-        :param song:    (song_title, playback_url, webpage_url, author of request, duration, thumbnail) |
-                        (song_title, song_url): tuple
+        :param song:    song to remove: Song
         :return:        Discord Embed: Embed
         """
         embed = Embed(title="Remove Song", color=self.embed_theme)
         embed.set_thumbnail(url=self.bot.user.display_avatar)
-        if len(song) == 2:
+        if not song.resolved:
             embed.add_field(name=f"Remove from Queue?: ",
-                            value=f"{song}",
+                            value=f"{song.display_title}",
                             inline=False)
         else:
             embed.add_field(name=f"Remove from Queue?: ",
-                            value=f"[{song[0]}]({song[2]})",
+                            value=f"[{song.title}]({song.webpage_url})",
                             inline=False)
-            embed.set_image(url=song[5])
+            embed.set_image(url=song.thumbnail)
         embed.set_footer(text=f"Generated by {ctx.message.author.name}", icon_url=ctx.message.author.display_avatar.url)
         return embed
 
@@ -338,6 +339,29 @@ class Embeds:
 
         return embed
 
+    def generate_db_stats_embed(self, ctx: Context, rows: List[Tuple[str, str, int, float, float, float]],
+                                since: str) -> Embed:
+        """
+            Generates embed for settings DB instrumentation
+
+        :param ctx:     context command was invoked under: Context
+        :param rows:    DBMetrics summary, list(tuple(kind, call site, count, avg ms, p95 ms, max ms)): List[tuple]
+        :param since:   when recording started: str
+        :return:        Discord Embed: Embed
+        """
+        embed = Embed(title="Settings DB Stats", description=f"Since {since}", color=self.embed_theme)
+        embed.set_thumbnail(url=self.bot.user.display_avatar)
+
+        for kind, call_site, count, avg_ms, p95_ms, max_ms in rows[:self.queue_display_length]:
+            embed.add_field(name=f"{kind} <- {call_site}",
+                            value=f"{count} calls, avg {avg_ms}ms, p95 {p95_ms}ms, max {max_ms}ms",
+                            inline=False)
+        if not rows:
+            embed.add_field(name="No settings I/O recorded", value='\u200b', inline=False)
+        elif len(rows) > self.queue_display_length:
+            embed.set_footer(text=f"+{len(rows) - self.queue_display_length} more, see console log")
+        return embed
+
     def doom_embed(self, ctx: Context) -> Embed:
         """
             Generates response to DOOM command
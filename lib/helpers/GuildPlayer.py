@@ -0,0 +1,251 @@
+# GuildPlayer.py
+
+import asyncio
+import contextvars
+import inspect
+import nextcord
+
+from typing import Any, Callable, Optional, TYPE_CHECKING
+from nextcord import VoiceClient
+from lib.helpers.GuildQueue import GuildQueue
+from traceback import format_exc
+
+if TYPE_CHECKING:
+    from lib.helpers.SongQueue import SongQueue
+
+
+class GuildPlayer:
+    """
+        Owns a guild's song queue and playback
+
+        Everything that changes the queue or what the voice client plays is sent to the player's mailbox as a
+        command. A single task runs the commands one at a time in the order they were sent, so a command can't
+        interleave with another one at its awaits (e.g. a skip landing between resolving the next song and
+        starting it) and the queue needs no locks. The queue is flagged for the next snapshot after every command.
+
+        The voice client's `after` callback sends a track-ended command. The task sleeps on its mailbox otherwise,
+        and exits once the queue has been empty for `idle_timeout` seconds.
+    """
+
+    def __init__(self, queues: 'SongQueue', guild_id: str, idle_timeout: float = 180):
+        """
+        :param queues:          song queue controller the player belongs to: SongQueue
+        :param guild_id:        Discord Guild ID: str
+        :param idle_timeout:    seconds without songs before the bot disconnects: float
+        """
+        self.queues = queues
+        self.guild_id = guild_id
+        self.idle_timeout = idle_timeout
+        # Context of the last play request, used to reach the voice client and send playback messages
+        self.ctx = None
+        self._mailbox = asyncio.Queue()
+        self._task = None
+        self._loop = None
+        # A song was started and its after callback hasn't been handled yet
+        self._playing = False
+        # The current song is being skipped, drop it even in loop mode
+        self._skip_current = False
+
+    @property
+    def queue(self) -> GuildQueue:
+        return self.queues.get_queue(self.guild_id)
+
+    async def run(self, command: Callable[[], Any]) -> Any:
+        """
+            Runs a command on the player after the ones already sent, commands sent by the player itself run inline
+
+        :param command:     function or coroutine function without arguments: Callable[[], Any]
+        :return:            what the command returned
+        """
+        if asyncio.current_task() is self._task:
+            self.queues.mark_changed(self.guild_id)
+            result = command()
+            return await result if inspect.isawaitable(result) else result
+        future = asyncio.get_running_loop().create_future()
+        self._send(command, future)
+        return await future
+
+    def send(self, command: Callable[[], Any]) -> None:
+        """
+            Sends a command to the player without waiting for it
+
+        :param command:     function or coroutine function without arguments: Callable[[], Any]
+        :return:            None
+        """
+        self._send(command, None)
+
+    def _send(self, command: Callable[[], Any], future: Optional[asyncio.Future]) -> None:
+        """
+            Puts a command in the mailbox, starts the player task if it isn't running
+
+        :param command:     function or coroutine function without arguments: Callable[[], Any]
+        :param future:      receives the command's result, None if nobody waits for it: asyncio.Future
+        :return:            None
+        """
+        self._mailbox.put_nowait((command, future))
+        if self._task is None or self._task.done():
+            # Fresh context, the player outlives the command that started it and must not report its call site
+            self._task = asyncio.get_running_loop().create_task(self._actor(), context=contextvars.Context())
+
+    def stop(self) -> None:
+        """
+            Stops the player task, pending commands are dropped
+                Callers waiting on a dropped or interrupted command get CancelledError instead of waiting forever
+
+        :return:    None
+        """
+        mailbox, self._mailbox = self._mailbox, asyncio.Queue()
+        while not mailbox.empty():
+            _, future = mailbox.get_nowait()
+            if future is not None and not future.done():
+                future.cancel()
+        if self._task is not None:
+            self._task.cancel()
+
+    async def _actor(self) -> None:
+        """
+            Runs commands from the mailbox until the player has been idle for `idle_timeout`
+
+        :return:    None
+        """
+        while True:
+            idle = not self.queue and not self._playing
+            try:
+                command, future = await asyncio.wait_for(self._mailbox.get(), self.idle_timeout if idle else None)
+            except asyncio.TimeoutError:
+                await self._time_out()
+                # Exit unless commands came in while timing out, later ones start a new task
+                if self._mailbox.empty():
+                    return
+                continue
+
+            try:
+                result = command()
+                if inspect.isawaitable(result):
+                    result = await result
+            except asyncio.CancelledError:
+                # Player stopped while running the command
+                if future is not None and not future.done():
+                    future.cancel()
+                raise
+            except Exception as e:
+                if future is None:
+                    if self.queues.config.debug_mode:
+                        print('GuildPlayer._actor | {}'.format(format_exc()))
+                elif not future.done():
+                    future.set_exception(e)
+            else:
+                if future is not None and not future.done():
+                    future.set_result(result)
+            self.queues.mark_changed(self.guild_id)
+
+    def _voice_client(self) -> Optional[VoiceClient]:
+        return self.ctx.guild.voice_client if self.ctx is not None else None
+
+    def _after(self, error: Optional[Exception]) -> None:
+        """
+            Voice client `after` callback, runs on the audio thread once a song is done (finished, stopped,
+            disconnected)
+
+        :param error:   playback error: Exception
+        :return:        None
+        """
+        if error and self.queues.config.debug_mode:
+            print('GuildPlayer._after | {}'.format(error))
+        self._loop.call_soon_threadsafe(self.send, self._track_ended)
+
+    async def play_next(self) -> None:
+        """
+            Starts the song at the head of the queue unless a song is already playing
+
+        :return:    None
+        """
+        vc = self._voice_client()
+        if self._playing or vc is None or not vc.is_connected():
+            return
+        try:
+            song_url = await self.queues.utilities.get_first_in_queue(self.queue)
+            if song_url is None:
+                # Queue ran out of playable songs or resolution was cancelled
+                return
+            # Create FFmpeg audio stream, attach to voice client
+            self._loop = asyncio.get_running_loop()
+            vc.play(nextcord.FFmpegPCMAudio(song_url, **self.queues.ffmpeg_opts), after=self._after)
+            self._playing = True
+            vc.source = nextcord.PCMVolumeTransformer(vc.source)
+            vc.volume = 1
+
+            # Resolve upcoming songs while this one plays
+            self.queues.prefetch_next(self.guild_id)
+
+            # Display now playing message
+            await self.ctx.invoke(self.queues.bot.get_command('np'))
+
+        except nextcord.errors.ClientException:
+            print(f"ClientException: Failed to Play Song in {self.ctx.guild.name}")
+
+    async def _track_ended(self) -> None:
+        """
+            Moves past the song that just ended and starts the next one
+
+        :return:    None
+        """
+        self._playing = False
+        try:
+            loop = (await self.queues.config_obj.get_guild_settings(self.guild_id))['loop']
+        except Exception:
+            # Settings can't be read, keep playing without looping
+            loop = False
+            if self.queues.config.debug_mode:
+                print('GuildPlayer._track_ended | {}'.format(format_exc()))
+        # Move to next song in queue once song is finished if loop is disabled
+        if self.queue and (not loop or self._skip_current):
+            self.queue.popleft()
+        # Move current song to the end of queue if loop is enabled
+        elif self.queue and loop:
+            self.queue.rotate()
+        self._skip_current = False
+        await self.play_next()
+
+    async def skip(self, num: int) -> None:
+        """
+            Skips the current song and the `num - 1` songs after it, only the current one if the queue is shorter
+
+        :param num:     number of songs to skip: int
+        :return:        None
+        """
+        if len(self.queue) >= num:
+            for _ in range(num - 1):
+                self.queue.pop(1)
+
+        vc = self._voice_client()
+        if self._playing and vc is not None:
+            # Stopping ends the song through the after callback, which moves on to the next one
+            self._skip_current = True
+            vc.stop()
+        elif self.queue:
+            self.queue.popleft()
+            await self.play_next()
+
+    async def _time_out(self) -> None:
+        """
+            Disconnects the bot once the queue has been empty for `idle_timeout`
+
+        :return:    None
+        """
+        vc = self._voice_client()
+        if self.ctx is None or self.queue or (vc is not None and vc.is_playing()):
+            return
+        try:
+            # Disconnect bot
+            await self.ctx.invoke(self.queues.bot.get_command('disconnect'))
+            # Make sure queue is cleared
+            await self.queues.clear_queue(self.guild_id)
+            # Turn off song loop in guild settings
+            server = await self.queues.config_obj.get_guild_settings(self.guild_id)
+            server['loop'] = False
+            await self.queues.config_obj.set_guild_settings(self.guild_id, server)
+
+        except nextcord.DiscordException:
+            if self.queues.config.debug_mode:
+                print('GuildPlayer._time_out | {}'.format(format_exc()))
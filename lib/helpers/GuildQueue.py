@@ -0,0 +1,363 @@
+# GuildQueue.py
+
+import random
+
+from typing import Iterable, Iterator, List, Union
+from lib.helpers.Song import Song
+
+
+class GuildQueue:
+    """
+        A guild's song queue, index 0 is the current song
+
+        Songs live in a slot array with free space before the head and after the tail. Removed songs leave empty
+        slots behind, a Fenwick tree over per-slot live counts maps queue positions to slots.
+            popleft, append, rotate     - O(1) amortized
+            [i], pop(i), remove(song)   - O(log n)
+            insert_next(songs)          - O(k log n) amortized, uses the free space before the head
+
+        Slots after the tail are pre-counted as live so appends never touch the tree. Slots passed by the head
+        keep their count, `_before_head` tracks their total instead so popleft doesn't touch the tree either.
+        The array is rebuilt when it runs out of space or fills up with empty slots.
+
+        Duration totals are kept up to date by every change, O(1) per song. Songs whose duration isn't known yet
+        count with a fixed estimate for their source, songs must be resolved through `resolve` while queued.
+    """
+
+    _MIN_CAPACITY = 16
+    # Estimated duration (seconds) of songs with unknown duration
+    #   search  - search keywords (Spotify/SoundCloud tracks)
+    #   link    - links (playlist entries without a duration, restored songs)
+    DURATION_PRIORS = {'search': 220, 'link': 300}
+
+    def __init__(self, songs: Iterable[Song] = ()):
+        self._rebuild(list(songs))
+
+    def _rebuild(self, songs: List[Song], slack: int = 0) -> None:
+        """
+            Lays songs out in a new slot array
+
+        :param songs:   songs in queue order: List[Song]
+        :param slack:   min free slots before the head: int
+        :return:        None
+        """
+        n = len(songs)
+        self._head = max(slack, n // 4, 1)
+        self._tail = self._head + n
+        capacity = max(self._MIN_CAPACITY, 2 * self._tail)
+        self._slots = [None] * capacity
+        self._slots[self._head:self._tail] = songs
+        self._positions = {id(song): self._head + i for i, song in enumerate(songs)}
+        self._length = n
+        self._before_head = 0
+        self._known_duration = 0
+        self._estimated_duration = 0
+        self._unknown_durations = 0
+        self._unresolved = 0
+        for song in songs:
+            self._tally(song, 1)
+
+        # Free slots before the head count 0, songs and the space after the tail count 1
+        self._counts = bytearray(self._head) + bytearray(b'\x01') * (capacity - self._head)
+        tree = [0] + list(self._counts)
+        for i in range(1, capacity + 1):
+            parent = i + (i & -i)
+            if parent <= capacity:
+                tree[parent] += tree[i]
+        self._tree = tree
+
+    def _tally(self, song: Song, sign: int) -> None:
+        """
+            Adds a song to (1) or removes it from (-1) the running totals
+
+        :param song:    song: Song
+        :param sign:    1 or -1: int
+        :return:        None
+        """
+        if song.duration is not None:
+            self._known_duration += sign * song.duration
+        else:
+            self._unknown_durations += sign
+            self._estimated_duration += sign * self.DURATION_PRIORS['link' if '://' in song.query else 'search']
+        if not song.resolved:
+            self._unresolved += sign
+
+    def _add(self, slot: int, delta: int) -> None:
+        """
+            Changes a slot's live count in the Fenwick tree
+
+        :param slot:    slot index: int
+        :param delta:   count change: int
+        :return:        None
+        """
+        self._counts[slot] += delta
+        i = slot + 1
+        capacity = len(self._slots)
+        while i <= capacity:
+            self._tree[i] += delta
+            i += i & -i
+
+    def _slot_of(self, index: int) -> int:
+        """
+            Finds the slot of a queue position
+
+        :param index:   queue position, negative counts from the end: int
+        :return:        slot index: int
+        """
+        if index < 0:
+            index += self._length
+        if not 0 <= index < self._length:
+            raise IndexError('GuildQueue index out of range')
+        if index == 0:
+            return self._head
+
+        # Smallest slot whose prefix count reaches the position
+        remaining = self._before_head + index + 1
+        capacity = len(self._slots)
+        slot = 0
+        step = 1 << capacity.bit_length()
+        while step:
+            nxt = slot + step
+            if nxt <= capacity and self._tree[nxt] < remaining:
+                slot = nxt
+                remaining -= self._tree[nxt]
+            step >>= 1
+        return slot
+
+    def _vacate(self, slot: int) -> Song:
+        """
+            Takes a song out of its slot
+
+        :param slot:    slot index: int
+        :return:        removed song: Song
+        """
+        song = self._slots[slot]
+        self._slots[slot] = None
+        del self._positions[id(song)]
+        self._length -= 1
+        self._tally(song, -1)
+
+        if slot == self._head:
+            # Advance the head past the song and any empty slots behind it
+            while self._head < self._tail and self._slots[self._head] is None:
+                self._before_head += self._counts[self._head]
+                self._head += 1
+        else:
+            self._add(slot, -1)
+            if self._tail - self._head > 2 * self._length + self._MIN_CAPACITY:
+                self._rebuild(list(self))
+        return song
+
+    def append(self, song: Song) -> None:
+        """
+            Adds a song to the end of the queue
+
+        :param song:    song: Song
+        :return:        None
+        """
+        if self._tail == len(self._slots):
+            self._rebuild(list(self))
+        self._slots[self._tail] = song
+        self._positions[id(song)] = self._tail
+        self._tail += 1
+        self._length += 1
+        self._tally(song, 1)
+
+    def extend(self, songs: Iterable[Song]) -> None:
+        """
+            Adds songs to the end of the queue
+
+        :param songs:   songs: Iterable[Song]
+        :return:        None
+        """
+        for song in songs:
+            self.append(song)
+
+    def insert_next(self, songs: List[Song]) -> None:
+        """
+            Inserts songs right after the current song
+
+        :param songs:   songs: List[Song]
+        :return:        None
+        """
+        if not self._length:
+            self.extend(songs)
+            return
+        k = len(songs)
+        if self._head < k:
+            self._rebuild([self[0]] + list(songs) + self[1:], slack=k + self._length // 4)
+            return
+
+        # Move the current song back k slots and fill the gap behind it
+        current = self._slots[self._head]
+        new_head = self._head - k
+        for slot, song in zip(range(new_head, self._head), [current] + list(songs)):
+            self._slots[slot] = song
+            self._positions[id(song)] = slot
+            self._before_head -= self._counts[slot]
+            if not self._counts[slot]:
+                self._add(slot, 1)
+        self._slots[self._head] = songs[-1]
+        self._positions[id(songs[-1])] = self._head
+        self._head = new_head
+        self._length += k
+        for song in songs:
+            self._tally(song, 1)
+
+    def popleft(self) -> Song:
+        """
+            Removes and returns the current song
+
+        :return:    current song: Song
+        """
+        if not self._length:
+            raise IndexError('popleft from an empty GuildQueue')
+        return self._vacate(self._head)
+
+    def rotate(self) -> None:
+        """
+            Moves the current song to the end of the queue (loop mode)
+
+        :return:    None
+        """
+        if self._length:
+            self.append(self.popleft())
+
+    def pop(self, index: int = -1) -> Song:
+        """
+            Removes and returns the song at a queue position
+
+        :param index:   queue position: int
+        :return:        removed song: Song
+        """
+        return self._vacate(self._slot_of(index))
+
+    def remove(self, song: Song) -> bool:
+        """
+            Removes a song wherever it is in the queue
+
+        :param song:    song: Song
+        :return:        True if the song was in the queue: bool
+        """
+        slot = self._positions.get(id(song))
+        if slot is None or self._slots[slot] is not song:
+            return False
+        self._vacate(slot)
+        return True
+
+    def shuffle(self, start: int = 0) -> None:
+        """
+            Shuffles the songs from a queue position on
+
+        :param start:   first position to shuffle, 1 keeps the current song in place: int
+        :return:        None
+        """
+        songs = list(self)
+        upcoming = songs[start:]
+        random.shuffle(upcoming)
+        self._rebuild(songs[:start] + upcoming)
+
+    def resolve(self, song: Song, song_info: dict) -> None:
+        """
+            Resolves a song in place, keeping the totals right if it is queued
+                NOTE: In-place modification
+
+        :param song:        song: Song
+        :param song_info:   dict from youtube_dl download: dict
+        :return:            None
+        """
+        queued = song in self
+        if queued:
+            self._tally(song, -1)
+        song.resolve(song_info)
+        if queued:
+            self._tally(song, 1)
+
+    def expire(self, song: Song) -> None:
+        """
+            Drops a song's expired playback url, keeping the totals right if it is queued
+                NOTE: In-place modification
+
+        :param song:    song: Song
+        :return:        None
+        """
+        queued = song in self
+        if queued:
+            self._tally(song, -1)
+        song.expire()
+        if queued:
+            self._tally(song, 1)
+
+    @property
+    def known_duration(self) -> int:
+        """
+            Total duration of the songs whose duration is known (seconds)
+
+        :return:    duration: int
+        """
+        return self._known_duration
+
+    @property
+    def estimated_duration(self) -> int:
+        """
+            Total duration with unknown durations estimated (seconds)
+
+        :return:    duration: int
+        """
+        return self._known_duration + self._estimated_duration
+
+    @property
+    def unknown_durations(self) -> int:
+        """
+            Number of songs whose duration isn't known yet
+
+        :return:    count: int
+        """
+        return self._unknown_durations
+
+    @property
+    def unresolved(self) -> int:
+        """
+            Number of songs that still have to be resolved before they can play
+
+        :return:    count: int
+        """
+        return self._unresolved
+
+    def clear(self) -> None:
+        """
+            Removes every song
+
+        :return:    None
+        """
+        self._rebuild([])
+
+    def __getitem__(self, index: Union[int, slice]) -> Union[Song, List[Song]]:
+        if isinstance(index, slice):
+            start, stop, step = index.indices(self._length)
+            if step != 1:
+                return list(self)[index]
+            if start >= stop:
+                return []
+            songs = []
+            slot = self._slot_of(start)
+            while len(songs) < stop - start:
+                if self._slots[slot] is not None:
+                    songs.append(self._slots[slot])
+                slot += 1
+            return songs
+        return self._slots[self._slot_of(index)]
+
+    def __iter__(self) -> Iterator[Song]:
+        return (song for song in self._slots[self._head:self._tail] if song is not None)
+
+    def __len__(self) -> int:
+        return self._length
+
+    def __contains__(self, song: Song) -> bool:
+        slot = self._positions.get(id(song))
+        return slot is not None and self._slots[slot] is song
+
+    def __repr__(self) -> str:
+        return f'GuildQueue({list(self)!r})'
+
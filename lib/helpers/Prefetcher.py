@@ -0,0 +1,78 @@
+# Prefetcher.py
+
+import asyncio
+import contextvars
+
+from typing import Union, Callable, Awaitable, Any
+from lib.helpers.Utils import Util
+from lib.helpers.Resolver import ResolveStatus, Priority
+from lib.helpers.GuildQueue import GuildQueue
+
+
+class Prefetcher:
+    """
+        Resolves the songs after the currently playing one while it plays
+
+        One prefetch task per guild, re-targeted whenever the head of the queue changes (track change, skip,
+        shuffle, remove) so track changes do not wait on youtube_dl. Resolved songs are filled in through the
+        guild's player, which owns the queue.
+    """
+
+    def __init__(self, utilities: Util, run_on_player: Callable[[Union[int, str], Callable[[], Any]], Awaitable[Any]],
+                 depth: int = 2):
+        """
+        :param utilities:       bot utilities holding the resolver: Util
+        :param run_on_player:   runs a queue change on a guild's player, see SongQueue.run_on_player: Callable
+        :param depth:           songs after the current one to resolve: int
+        """
+        self.utilities = utilities
+        self.run_on_player = run_on_player
+        self.depth = max(0, depth)
+        self._tasks = {}
+
+    def retarget(self, guild_id: Union[int, str], queue: GuildQueue) -> None:
+        """
+            Restarts a guild's prefetch for the current queue order
+
+        :param guild_id:    Discord Guild ID: Union[int, str]
+        :param queue:       Server song queue: GuildQueue
+        :return:            None
+        """
+        self.cancel(guild_id)
+        if self.depth and any(not song.resolved for song in queue[1:1 + self.depth]):
+            self._tasks[str(guild_id)] = asyncio.get_running_loop().create_task(self._prefetch(guild_id, queue),
+                                                                                context=contextvars.Context())
+
+    def cancel(self, guild_id: Union[int, str]) -> None:
+        """
+            Stops a guild's pending prefetch
+
+        :param guild_id:    Discord Guild ID: Union[int, str]
+        :return:            None
+        """
+        task = self._tasks.pop(str(guild_id), None)
+        if task is not None and not task.done():
+            task.cancel()
+
+    async def _prefetch(self, guild_id: Union[int, str], queue: GuildQueue) -> None:
+        """
+            Resolves non-youtube sourced songs in the prefetch window
+                NOTE: In-place modification
+
+        :param guild_id:    Discord Guild ID: Union[int, str]
+        :param queue:       Server song queue: GuildQueue
+        :return:            None
+        """
+        for song in queue[1:1 + self.depth]:
+            if song.resolved:
+                continue
+            result = await self.utilities.resolver.resolve(song.query, song.author.guild.id, Priority.NEXT_UP, song)
+            if result.status is ResolveStatus.CANCELLED:
+                return
+            # Failures are left for get_first_in_queue to skip past once the song reaches the head
+            if result.ok:
+                def resolve() -> None:
+                    if not song.resolved:
+                        queue.resolve(song, self.utilities.first_song_info(result.song_info))
+
+                await self.run_on_player(guild_id, resolve)
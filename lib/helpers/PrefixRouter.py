@@ -0,0 +1,63 @@
+# PrefixRouter.py
+
+from typing import Union
+from nextcord import Client, Message
+
+
+class PrefixRouter:
+    """
+        In-memory guild_id -> prefix map used as the bot's command_prefix callback
+
+        Lookups never touch the DB, guilds without settings fall back to the default prefix
+    """
+
+    def __init__(self, default_prefix: str = '~'):
+        self.default_prefix = default_prefix
+        self._prefixes = {}
+
+    def load(self, server_settings: dict, default_prefix: str = None) -> None:
+        """
+            Replaces the map with prefixes from SERVER_SETTINGS
+
+        :param server_settings:     {guild_id: {"prefix": str, "loop": bool}}: dict
+        :param default_prefix:      fallback prefix for unknown guilds, unchanged if None: str
+        :return:                    None
+        """
+        if default_prefix:
+            self.default_prefix = default_prefix
+        self._prefixes = {str(guild_id): settings['prefix']
+                          for guild_id, settings in server_settings.items() if settings.get('prefix')}
+
+    def set_prefix(self, guild_id: Union[int, str], prefix: str) -> None:
+        """
+            Sets a guild's prefix
+
+        :param guild_id:    Discord Guild ID: Union[int, str]
+        :param prefix:      new prefix: str
+        :return:            None
+        """
+        if prefix:
+            self._prefixes[str(guild_id)] = prefix
+        else:
+            self._prefixes.pop(str(guild_id), None)
+
+    def remove_guild(self, guild_id: Union[int, str]) -> None:
+        """
+            Forgets a guild's prefix, the guild falls back to the default prefix
+
+        :param guild_id:    Discord Guild ID: Union[int, str]
+        :return:            None
+        """
+        self._prefixes.pop(str(guild_id), None)
+
+    def get_prefix(self, client: Client, message: Message) -> str:
+        """
+            Resolves the prefix for a message
+
+        :param client:      nextcord.Client object, automatically passed: Client
+        :param message:     nextcord.Message object: Message
+        :return:            guild prefix, default prefix in DMs and unknown guilds: str
+        """
+        if message is None or not message.guild:
+            return self.default_prefix
+        return self._prefixes.get(str(message.guild.id), self.default_prefix)
@@ -0,0 +1,116 @@
+# QueryIndex.py
+
+import sqlite3
+import threading
+import time
+
+from typing import Optional
+
+
+class QueryIndex:
+    """
+        Persistent normalized search string -> video map, kept in a local SQLite file
+
+        Lets known "{title} {artist}" searches skip the yt-dlp search step across restarts and go straight to
+        format extraction of the indexed video. Methods are blocking, the resolver runs them off the event loop.
+    """
+
+    def __init__(self, path: str = 'query-index.sqlite3'):
+        """
+        :param path:    SQLite file path: str
+        """
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('PRAGMA synchronous=NORMAL')
+        self._connection.execute("""
+            CREATE TABLE IF NOT EXISTS "query-index" (
+                query TEXT PRIMARY KEY,
+                video_id TEXT NOT NULL,
+                webpage_url TEXT NOT NULL,
+                title TEXT,
+                duration INTEGER,
+                thumbnail TEXT,
+                updated REAL
+            );
+        """)
+        self._connection.commit()
+
+    def lookup(self, query: str) -> Optional[dict]:
+        """
+            Finds the video a search string resolved to before
+
+        :param query:   normalized search keywords: str
+        :return:        {"video_id", "webpage_url", "title", "duration", "thumbnail"}, None if unknown: dict
+        """
+        with self._lock:
+            row = self._connection.execute("""
+                SELECT video_id, webpage_url, title, duration, thumbnail
+                FROM "query-index"
+                WHERE query = ?
+            """, (query,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return dict(zip(('video_id', 'webpage_url', 'title', 'duration', 'thumbnail'), row))
+
+    def record(self, query: str, song_info: dict) -> None:
+        """
+            Indexes the video a search string resolved to
+
+        :param query:       normalized search keywords: str
+        :param song_info:   song info dict from youtube_dl: dict
+        :return:            None
+        """
+        try:
+            values = (query, song_info['id'], song_info['webpage_url'], song_info.get('title'),
+                      song_info.get('duration'), song_info['thumbnails'][-1]['url'], time.time())
+        except (KeyError, IndexError, TypeError):
+            return
+        with self._lock:
+            self._connection.execute("""
+                INSERT INTO "query-index"(
+                    query, video_id, webpage_url, title, duration, thumbnail, updated)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (query) DO UPDATE
+                    SET video_id = excluded.video_id, webpage_url = excluded.webpage_url, title = excluded.title,
+                        duration = excluded.duration, thumbnail = excluded.thumbnail, updated = excluded.updated;
+            """, values)
+            self._connection.commit()
+
+    def forget(self, query: str) -> None:
+        """
+            Drops a search string whose indexed video can no longer be extracted
+
+        :param query:   normalized search keywords: str
+        :return:        None
+        """
+        with self._lock:
+            self._connection.execute('DELETE FROM "query-index" WHERE query = ?', (query,))
+            self._connection.commit()
+
+    def stats(self) -> dict:
+        """
+            Reports index size and lookup hit rate since start-up
+
+        :return:    {"entries": int, "hits": int, "misses": int, "hit_rate": float}: dict
+        """
+        with self._lock:
+            entries = self._connection.execute('SELECT COUNT(*) FROM "query-index"').fetchone()[0]
+            hits, misses = self.hits, self.misses
+        lookups = hits + misses
+        return {"entries": entries, "hits": hits, "misses": misses,
+                "hit_rate": round(hits / lookups, 3) if lookups else 0.0}
+
+    def close(self) -> None:
+        """
+            Closes the index file
+
+        :return:    None
+        """
+        with self._lock:
+            self._connection.close()
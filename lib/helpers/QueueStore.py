@@ -0,0 +1,89 @@
+# QueueStore.py
+
+import json
+import sqlite3
+import threading
+import time
+
+from typing import Dict, List
+from traceback import format_exc
+
+
+class QueueStore:
+    """
+        Last known song queue of each guild, kept in a local SQLite file
+
+        A queue is stored as a single row of compact JSON song records (see Song.to_record) so snapshots survive
+        crashes and restarts. Methods are blocking, callers run them off the event loop.
+    """
+
+    def __init__(self, path: str = 'queue-store.sqlite3', debug_mode: bool = False):
+        """
+        :param path:        SQLite file path: str
+        :param debug_mode:  print tracebacks of failed writes: bool
+        """
+        self.path = path
+        self.debug_mode = debug_mode
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('PRAGMA synchronous=NORMAL')
+        self._connection.execute("""
+            CREATE TABLE IF NOT EXISTS "queue-snapshots" (
+                guild_id TEXT PRIMARY KEY,
+                songs TEXT NOT NULL,
+                updated REAL
+            );
+        """)
+        self._connection.commit()
+
+    def save(self, queues: Dict[str, List[list]]) -> bool:
+        """
+            Replaces the stored queues of several guilds in a single transaction, empty queues are deleted
+
+        :param queues:  {guild_id: [song record, ...]}: Dict[str, List[list]]
+        :return:        True if the snapshot was written: bool
+        """
+        now = time.time()
+        upserts = [(guild_id, json.dumps(records, separators=(',', ':')), now)
+                   for guild_id, records in queues.items() if records]
+        deletes = [(guild_id,) for guild_id, records in queues.items() if not records]
+        try:
+            with self._lock, self._connection:
+                self._connection.executemany("""
+                    INSERT INTO "queue-snapshots"(guild_id, songs, updated)
+                    VALUES (?, ?, ?)
+                    ON CONFLICT (guild_id) DO UPDATE
+                        SET songs = excluded.songs, updated = excluded.updated;
+                """, upserts)
+                self._connection.executemany('DELETE FROM "queue-snapshots" WHERE guild_id = ?', deletes)
+        except sqlite3.Error:
+            if self.debug_mode:
+                print('QueueStore.save | {}'.format(format_exc()))
+            return False
+        return True
+
+    def load(self) -> Dict[str, List[list]]:
+        """
+            Reads every stored queue
+
+        :return:    {guild_id: [song record, ...]}: Dict[str, List[list]]
+        """
+        with self._lock:
+            rows = self._connection.execute('SELECT guild_id, songs FROM "queue-snapshots"').fetchall()
+        queues = {}
+        for guild_id, songs in rows:
+            try:
+                queues[guild_id] = json.loads(songs)
+            except ValueError:
+                print(f"Discarding unreadable stored queue of guild {guild_id}")
+        return queues
+
+    def close(self) -> None:
+        """
+            Closes the store file
+
+        :return:    None
+        """
+        with self._lock:
+            self._connection.close()
@@ -0,0 +1,220 @@
+# ResolutionScheduler.py
+
+import asyncio
+import contextvars
+import time
+
+from collections import deque
+from typing import Union, Optional, List, Callable, Awaitable, Any
+from lib.helpers.Utils import Util
+from lib.helpers.Resolver import ResolveStatus, Priority
+from lib.helpers.Song import Song
+from lib.helpers.GuildQueue import GuildQueue
+from traceback import format_exc
+
+
+class ResolutionScheduler:
+    """
+        Resolves non-youtube sourced songs in the background as they are queued
+
+        Adding songs pushes work items, a fixed set of workers resolves them concurrently taking one song per guild
+        in turn (round-robin) so one large playlist can't starve other guilds. Idle guilds cost nothing.
+
+        Items are kept per priority class (see Priority), the most urgent class goes first. Waiting items age into
+        higher classes (`aging` seconds per class) so the backlog keeps moving. Resolutions in progress are never
+        preempted, re-submitting a pending song at a higher priority moves it up.
+
+        Results are applied to the queue through the guild's player, which owns the queue.
+    """
+
+    def __init__(self, utilities: Util, run_on_player: Callable[[Union[int, str], Callable[[], Any]], Awaitable[Any]],
+                 workers: int = 4, aging: float = 15):
+        """
+        :param utilities:       bot utilities holding the resolver: Util
+        :param run_on_player:   runs a queue change on a guild's player, see SongQueue.run_on_player: Callable
+        :param workers:         concurrent resolutions: int
+        :param aging:           seconds of waiting worth one priority class: float
+        """
+        self.utilities = utilities
+        self.run_on_player = run_on_player
+        self.workers = max(1, workers)
+        self.aging = max(0.001, aging)
+        # {priority: ({guild_id: deque((queue, song, enqueued at))}, guilds with pending songs in round-robin order)}
+        self._classes = {priority: ({}, deque()) for priority in Priority}
+        # {id(song): priority} of pending songs, items of other classes are outdated copies
+        self._queued = {}
+        # id(song) of songs being resolved, and of those among them that were dropped and must not be re-submitted
+        self._running = set()
+        self._dropped = set()
+        self._wakeup = None
+        self._tasks = []
+
+    def submit(self, guild_id: Union[int, str], queue: GuildQueue, songs: Optional[List[Song]] = None,
+               priority: Priority = Priority.BACKLOG) -> None:
+        """
+            Schedules resolution of a guild's non-youtube sourced songs
+
+        :param guild_id:    Discord Guild ID: Union[int, str]
+        :param queue:       Server song queue the songs are in: GuildQueue
+        :param songs:       songs to resolve, every unresolved song in the queue if None: List[Song]
+        :param priority:    priority class of the songs: Priority
+        :return:            None
+        """
+        now = time.monotonic()
+        items = []
+        for song in (queue if songs is None else songs):
+            if not song.resolved and self._queued.get(id(song), Priority.BACKLOG + 1) > priority:
+                self._queued[id(song)] = priority
+                items.append((queue, song, now))
+        if not items:
+            return
+        guild_id = str(guild_id)
+        pending, ring = self._classes[priority]
+        if guild_id not in pending:
+            pending[guild_id] = deque()
+            ring.append(guild_id)
+        pending[guild_id].extend(items)
+        self._start()
+        self._wakeup.set()
+
+    def cancel(self, guild_id: Union[int, str]) -> None:
+        """
+            Drops a guild's songs that are still waiting to be resolved
+
+        :param guild_id:    Discord Guild ID: Union[int, str]
+        :return:            None
+        """
+        for pending, ring in self._classes.values():
+            items = pending.pop(str(guild_id), None)
+            if items is not None:
+                ring.remove(str(guild_id))
+                for _, song, _ in items:
+                    self._queued.pop(id(song), None)
+
+    def drop(self, songs: List[Song]) -> None:
+        """
+            Forgets songs that are about to leave the queue (skip), a cancelled resolution of one is not retried
+
+        :param songs:   songs to forget: List[Song]
+        :return:        None
+        """
+        for song in songs:
+            # Pending items of the song are skipped once they come up
+            self._queued.pop(id(song), None)
+            if id(song) in self._running:
+                self._dropped.add(id(song))
+
+    def stop(self) -> None:
+        """
+            Stops the workers, pending songs are dropped
+
+        :return:    None
+        """
+        for task in self._tasks:
+            task.cancel()
+        self._tasks.clear()
+        for pending, ring in self._classes.values():
+            pending.clear()
+            ring.clear()
+        self._queued.clear()
+        self._running.clear()
+        self._dropped.clear()
+
+    def _start(self) -> None:
+        """
+            Starts the workers on first use, they need a running event loop
+
+        :return:    None
+        """
+        if self._tasks:
+            return
+        self._wakeup = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        # Fresh contexts, the workers must not inherit the call site of the command that started them
+        self._tasks = [loop.create_task(self._worker(), context=contextvars.Context()) for _ in range(self.workers)]
+
+    def _next_item(self) -> Optional[tuple]:
+        """
+            Takes the next song of the next guild in turn from the most urgent class, counting waiting time
+
+        :return:    (guild_id, queue, song, priority), None if nothing is pending: tuple
+        """
+        while True:
+            now = time.monotonic()
+            best = None
+            for priority, (pending, ring) in self._classes.items():
+                if ring:
+                    urgency = priority - (now - pending[ring[0]][0][2]) / self.aging
+                    if best is None or urgency < best[0]:
+                        best = (urgency, priority)
+            if best is None:
+                return None
+
+            priority = best[1]
+            pending, ring = self._classes[priority]
+            guild_id = ring.popleft()
+            queue, song, _ = pending[guild_id].popleft()
+            if pending[guild_id]:
+                ring.append(guild_id)
+            else:
+                del pending[guild_id]
+            # Skip copies left behind when the song was moved to a more urgent class
+            if self._queued.get(id(song)) == priority:
+                del self._queued[id(song)]
+                return guild_id, queue, song, priority
+
+    async def _worker(self) -> None:
+        """
+            Resolves pending songs until stopped
+
+        :return:    None
+        """
+        while True:
+            item = self._next_item()
+            if item is None:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            try:
+                await self._resolve(*item)
+            except Exception:
+                if self.utilities.config.debug_mode:
+                    print('ResolutionScheduler._worker | {}'.format(format_exc()))
+
+    async def _resolve(self, guild_id: str, queue: GuildQueue, song: Song, priority: Priority) -> None:
+        """
+            Resolves a song in place
+                NOTE: In-place modification
+
+        :param guild_id:    Discord Guild ID: str
+        :param queue:       Server song queue: GuildQueue
+        :param song:        unresolved song: Song
+        :param priority:    priority class of the song: Priority
+        :return:            None
+        """
+        if song.resolved:
+            return
+        self._running.add(id(song))
+        try:
+            result = await self.utilities.resolver.resolve(song.query, guild_id, priority, song)
+        finally:
+            self._running.discard(id(song))
+            dropped = id(song) in self._dropped
+            self._dropped.discard(id(song))
+        if result.status is ResolveStatus.CANCELLED:
+            # Cancelled for a skip or clear that didn't remove this song, try it again
+            if not dropped and song in queue and not song.resolved:
+                self.submit(guild_id, queue, [song], priority)
+            return
+        if result.status is ResolveStatus.TIMED_OUT:
+            return
+
+        if result.ok:
+            def resolve() -> None:
+                if not song.resolved:
+                    queue.resolve(song, self.utilities.first_song_info(result.song_info))
+
+            await self.run_on_player(guild_id, resolve)
+        else:
+            # Song can't be found, drop it instead of retrying it when it comes up
+            await self.run_on_player(guild_id, lambda: queue.remove(song))
@@ -0,0 +1,539 @@
+# Resolver.py
+
+import asyncio
+import threading
+import time
+import yt_dlp as youtube_dl
+
+from concurrent.futures import Executor, ThreadPoolExecutor, ProcessPoolExecutor
+from typing import Union, List, Optional, Any, Awaitable, Callable
+from dataclasses import dataclass
+from enum import Enum, IntEnum
+from contextvars import ContextVar
+from traceback import format_exc, format_exception
+from lib.helpers.BotSettings import BotSettings
+from lib.helpers.SongCache import SongCache
+from lib.helpers.QueryIndex import QueryIndex
+
+
+# Per worker thread/process YoutubeDL instances, reused across extractions
+#   {'full' | 'flat': [YoutubeDL, options, uses]}
+_worker = threading.local()
+
+# Playlist entries are only listed (id, url, title), not resolved
+FLAT_PLAYLIST_OPTS = {'extract_flat': 'in_playlist'}
+
+
+def _worker_ydl(ydl_opts: dict, recycle_after: int, slot: str = 'full') -> youtube_dl.YoutubeDL:
+    """
+        Gets this worker's YoutubeDL instance, creating a new one when missing, worn out or options changed
+
+    :param ydl_opts:        youtube_dl options: dict
+    :param recycle_after:   extractions before the instance is replaced: int
+    :param slot:            'full' or 'flat' extraction instance: str
+    :return:                worker's YoutubeDL instance: YoutubeDL
+    """
+    if not hasattr(_worker, 'instances'):
+        _worker.instances = {}
+    instance = _worker.instances.get(slot)
+    if instance is not None and (instance[2] >= recycle_after or instance[1] != ydl_opts):
+        _recycle_worker_ydl(slot)
+        instance = None
+    if instance is None:
+        instance = _worker.instances[slot] = [youtube_dl.YoutubeDL(dict(ydl_opts)), ydl_opts, 0]
+    instance[2] += 1
+    return instance[0]
+
+
+def _recycle_worker_ydl(slot: str = 'full') -> None:
+    """
+        Closes and drops one of this worker's YoutubeDL instances
+
+    :param slot:    'full' or 'flat' extraction instance: str
+    :return:        None
+    """
+    instance = getattr(_worker, 'instances', {}).pop(slot, None)
+    if instance is not None:
+        try:
+            instance[0].close()
+        except Exception:
+            pass
+
+
+def extract_info(link: str, ydl_opts: dict, debug_mode: bool = False,
+                 recycle_after: int = 100, flat: bool = False) -> Union[dict, List[dict]]:
+    """
+        Extracts info from yt link or search keywords with youtube_dl
+            Runs inside a resolver worker, module level so it can be sent to worker processes.
+            The worker's YoutubeDL instance is reused and replaced after `recycle_after` extractions or an error.
+
+    :param link:            link or search keywords: str
+    :param ydl_opts:        youtube_dl options: dict
+    :param debug_mode:      print tracebacks: bool
+    :param recycle_after:   extractions before a worker's YoutubeDL instance is replaced: int
+    :param flat:            only list playlist entries instead of resolving each one: bool
+    :return:                song info dict
+                            list of song info dicts if link is a playlist (flat entries if `flat`)
+                            None if nothing was found
+    """
+    slot = 'flat' if flat else 'full'
+    if flat:
+        ydl_opts = {**ydl_opts, **FLAT_PLAYLIST_OPTS}
+    # Call Youtube_DL to fetch song info, retries are up to the resolver
+    ydl = _worker_ydl(ydl_opts, recycle_after, slot)
+    try:
+        song_info = ydl.extract_info(link, download=False)
+    except BaseException:
+        # Instance may be left in a bad state, start fresh on the next extraction
+        _recycle_worker_ydl(slot)
+        raise
+    # Detect if link is a playlist
+    try:
+        if song_info and song_info['_type'] == 'playlist':
+            # If link is a playlist set song_info to a list of songs
+            song_info = song_info['entries']
+    except KeyError:
+        if debug_mode:
+            print('Resolver.extract_info | {}'.format(format_exc()))
+    return song_info or None
+
+
+# Parts of yt-dlp error messages (lowercase) meaning the video itself is gone, not a transient failure
+UNAVAILABLE_ERRORS = ('video unavailable', 'private video', 'has been removed', 'account associated with this video',
+                      'not available in your country', 'no longer available', 'does not exist')
+
+
+class ResolveError(Exception):
+    """
+        Raised when every extraction attempt of a query failed
+            `unavailable` is set if the video is gone for good (removed, private, region locked) or nothing was
+            found, as opposed to timeouts and network errors
+    """
+
+    def __init__(self, message: str, unavailable: bool = False):
+        super().__init__(message)
+        self.unavailable = unavailable
+
+
+class Priority(IntEnum):
+    """
+        Resolution priority classes, lower is more urgent
+    """
+    NOW_PLAYING = 0     # Song about to play or skip target, a user is waiting on it
+    NEXT_UP = 1         # Prefetch of the songs after the current one
+    VISIBLE = 2         # Songs on a QueueView page someone is looking at
+    BACKLOG = 3         # Everything else in the queue
+
+
+# Mutable [Priority] of the extraction running in the current in-flight task, raised when a more urgent request joins
+_flight_priority: ContextVar[List[Priority]] = ContextVar('_flight_priority')
+
+
+class ResolveStatus(Enum):
+    RESOLVED = 'resolved'
+    FAILED = 'failed'
+    TIMED_OUT = 'timed out'
+    CANCELLED = 'cancelled'
+
+
+@dataclass(frozen=True, slots=True)
+class ResolveResult:
+    """
+        Outcome of a resolution, failures are returned instead of raised so the queue can skip past them
+    """
+    query: str
+    status: ResolveStatus
+    song_info: Union[dict, List[dict], None] = None
+    error: Optional[str] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.status is ResolveStatus.RESOLVED
+
+
+class Resolver:
+    """
+        Runs youtube_dl extraction on a bounded worker pool so it never blocks the event loop
+
+        Configured by the 'Resolver' section of app-settings.json:
+            workers         - max concurrent extractions
+            mode            - 'thread' or 'process' workers
+            recycle_after   - extractions before a worker's YoutubeDL instance is replaced
+            cache_size      - max songs in the resolved metadata cache
+            stream_ttl      - playback url lifetime when the url has no embedded expiry (seconds)
+            refresh_margin  - cached playback urls closer than this to expiry are refreshed (seconds)
+            index_path      - SQLite file of the persistent search -> video index, empty to disable
+            timeout         - deadline of a whole resolution including retries (seconds)
+            retries         - extraction attempts per resolution
+            backoff         - delay before the first retry, doubled for each further retry (seconds)
+            max_backoff     - retry delay cap (seconds)
+            aging           - seconds an extraction waits for a worker to move up one priority class
+
+        Single songs are cached, a hit with a near-expiry playback url re-extracts only the song's own page
+        instead of repeating the search. Searches missing from the cache are looked up in the persistent index,
+        known searches extract the indexed video directly.
+
+        Concurrent requests for the same query share one in-flight extraction. Requests made for a queued song can
+        be cancelled with `cancel_guild` (skip, clear, disconnect), requests for user commands (play, search) are
+        never cancelled. The shared extraction is only cancelled once no request is waiting on it anymore.
+
+        Free workers go to the most urgent waiting extraction (see Priority), joining a lower priority in-flight
+        extraction raises its priority. Running extractions are never preempted, waiting ones age into higher
+        classes so the backlog can't starve.
+    """
+
+    def __init__(self, settings: BotSettings, workers: int = 4, mode: str = 'thread', recycle_after: int = 100,
+                 cache_size: int = 2048, stream_ttl: float = 3600, refresh_margin: float = 600,
+                 index_path: str = 'query-index.sqlite3', timeout: float = 30, retries: int = 3,
+                 backoff: float = 0.5, max_backoff: float = 4, aging: float = 15):
+        self.ydl_opts = dict(settings.ydl_opts)
+        self.debug_mode = settings.debug_mode
+        self.workers = max(1, workers)
+        self.mode = mode
+        self.recycle_after = max(1, recycle_after)
+        self.executor = self._create_executor()
+        self.cache = SongCache(cache_size, stream_ttl, refresh_margin)
+        self.index = QueryIndex(index_path) if index_path else None
+        self.timeout = timeout
+        self.retries = max(1, retries)
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.aging = max(0.001, aging)
+        # {(kind, normalized query): [Task, waiting requests, [Priority]]} of extractions in progress
+        self._in_flight = {}
+        # Idle workers and [[Priority], enqueued at, Future] of extractions waiting for one
+        self._free_workers = self.workers
+        self._worker_waiters = []
+        # {guild_id: {Task: Song}} of queued songs' requests waiting on extractions
+        self._guild_requests = {}
+
+    def _create_executor(self) -> Executor:
+        """
+            Creates the worker pool selected by `mode`
+
+        :return:    worker pool: Executor
+        """
+        if self.mode == 'process':
+            return ProcessPoolExecutor(max_workers=self.workers)
+        if self.mode != 'thread':
+            print(f"Unknown resolver mode '{self.mode}', using threads")
+        return ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='resolver')
+
+    async def _request(self, key: tuple, func: Callable[[str], Awaitable[Any]], query: str,
+                       guild_id: Union[int, str, None], priority: Priority, song: Any = None) -> ResolveResult:
+        """
+            Waits on the shared extraction of a query on behalf of a guild
+
+        :param key:         (kind, normalized query): tuple
+        :param func:        resolver coroutine function: Callable[[str], Awaitable[Any]]
+        :param query:       link or search keywords: str
+        :param guild_id:    Discord Guild ID the request is made for: Union[int, str]
+        :param priority:    urgency of the request: Priority
+        :param song:        queued song the request resolves, None if not cancellable: Song
+        :return:            typed outcome: ResolveResult
+        """
+        request = asyncio.get_running_loop().create_task(self._single_flight(key, func, query, priority))
+        cancellable = guild_id is not None and song is not None
+        requests = self._guild_requests.setdefault(str(guild_id), {}) if cancellable else {}
+        requests[request] = song
+        try:
+            await asyncio.wait({request})
+        except asyncio.CancelledError:
+            # Caller itself was cancelled
+            request.cancel()
+            raise
+        finally:
+            requests.pop(request, None)
+            if not requests and self._guild_requests.get(str(guild_id)) is requests:
+                del self._guild_requests[str(guild_id)]
+
+        if request.cancelled():
+            return ResolveResult(query, ResolveStatus.CANCELLED)
+        error = request.exception()
+        if error is None:
+            return ResolveResult(query, ResolveStatus.RESOLVED, request.result())
+        if isinstance(error, asyncio.TimeoutError):
+            return ResolveResult(query, ResolveStatus.TIMED_OUT, error=f'No result within {self.timeout}s')
+        if self.debug_mode:
+            print('Resolver.resolve | {}'.format(''.join(format_exception(error))))
+        return ResolveResult(query, ResolveStatus.FAILED, error=str(error))
+
+    def cancel_guild(self, guild_id: Union[int, str], songs: Optional[list] = None) -> None:
+        """
+            Cancels a guild's pending requests for queued songs, they return a CANCELLED result
+                Requests made without a song (play, search) are left running
+
+        :param guild_id:    Discord Guild ID: Union[int, str]
+        :param songs:       songs whose requests to cancel, every queued song's if None: list
+        :return:            None
+        """
+        requests = self._guild_requests.get(str(guild_id), {})
+        targets = None if songs is None else {id(song) for song in songs}
+        for request, song in list(requests.items()):
+            if targets is None or id(song) in targets:
+                request.cancel()
+
+    async def _single_flight(self, key: tuple, func: Callable[[str], Awaitable[Any]], query: str,
+                             priority: Priority) -> Any:
+        """
+            Runs `func(query)` under the resolution deadline once for all concurrent callers with the same key
+                The shared task is shielded, a cancelled caller does not cancel it for the others
+
+        :param key:         (kind, normalized query): tuple
+        :param func:        resolver coroutine function: Callable[[str], Awaitable[Any]]
+        :param query:       link or search keywords: str
+        :param priority:    urgency of the caller: Priority
+        :return:            result of func
+        """
+        flight = self._in_flight.get(key)
+        if flight is None:
+            box = [priority]
+            token = _flight_priority.set(box)
+            try:
+                task = asyncio.get_running_loop().create_task(asyncio.wait_for(func(query), self.timeout))
+            finally:
+                _flight_priority.reset(token)
+            flight = self._in_flight[key] = [task, 0, box]
+            task.add_done_callback(lambda done: self._finish_flight(key, done))
+        elif priority < flight[2][0]:
+            flight[2][0] = priority
+        task = flight[0]
+        flight[1] += 1
+        try:
+            return await asyncio.shield(task)
+        finally:
+            flight[1] -= 1
+            # Nobody is waiting anymore, stop retrying
+            if not flight[1] and not task.done():
+                task.cancel()
+
+    def _finish_flight(self, key: tuple, task: asyncio.Task) -> None:
+        """
+            Forgets a finished in-flight extraction
+
+        :param key:     (kind, normalized query): tuple
+        :param task:    finished extraction: Task
+        :return:        None
+        """
+        if key in self._in_flight and self._in_flight[key][0] is task:
+            del self._in_flight[key]
+        # Mark the error as retrieved in case every caller was cancelled
+        if not task.cancelled():
+            task.exception()
+
+    async def resolve(self, query: str, guild_id: Union[int, str] = None,
+                      priority: Priority = Priority.NOW_PLAYING, song: Any = None) -> ResolveResult:
+        """
+            Resolves a link or search keywords to song info on a worker
+
+        :param query:       link or search keywords: str
+        :param guild_id:    Discord Guild ID the song is for: Union[int, str]
+        :param priority:    urgency of the request: Priority
+        :param song:        queued song being resolved, lets `cancel_guild` cancel the request: Song
+        :return:            typed outcome, song_info is a song info dict
+                            or a list of song info dicts if link is a playlist or search: ResolveResult
+        """
+        return await self._request(('resolve', SongCache.normalize(query)), self._resolve, query, guild_id, priority,
+                                   song)
+
+    async def _resolve(self, query: str) -> Union[dict, List[dict]]:
+        """
+            Resolves a query through the cache, the query index and finally youtube_dl
+
+        :param query:   link or search keywords: str
+        :return:        song info dict
+                        list of song info dicts if link is a playlist or search
+        """
+        cached = self.cache.get(query)
+        if cached is not None:
+            if not self.cache.is_fresh(cached):
+                self.cache.refresh_stream(cached, await self._extract(cached.webpage_url))
+            return cached.to_song_info()
+
+        song_info = await self._resolve_indexed(query) if self.index and not SongCache.is_url(query) else None
+        if song_info is None:
+            song_info = await self._extract(query)
+            if self.index and not SongCache.is_url(query) and isinstance(song_info, list) and len(song_info) == 1:
+                await asyncio.get_running_loop().run_in_executor(None, self.index.record,
+                                                                 SongCache.normalize(query), song_info[0])
+        self._stamp_expiry(song_info)
+        self.cache.put(query, song_info)
+        return song_info
+
+    def _stamp_expiry(self, song_info: Union[dict, List[dict]]) -> None:
+        """
+            Records when each playback url expires, once, as it is extracted
+                NOTE: In-place modification
+
+        :param song_info:   song info dict or list of song info dicts from youtube_dl: Union[dict, List[dict]]
+        :return:            None
+        """
+        for entry in (song_info if isinstance(song_info, list) else [song_info]):
+            if isinstance(entry, dict) and entry.get('url') and 'expires_at' not in entry:
+                entry['expires_at'] = self.cache.stream_expiry(entry['url'])
+
+    async def _resolve_indexed(self, query: str) -> Optional[List[dict]]:
+        """
+            Skips the search step for search keywords found in the persistent index
+
+        :param query:   search keywords: str
+        :return:        single item list of song info in search result shape, None if not indexed: List[dict]
+        """
+        loop = asyncio.get_running_loop()
+        key = SongCache.normalize(query)
+        indexed = await loop.run_in_executor(None, self.index.lookup, key)
+        if indexed is None:
+            return None
+        try:
+            song_info = await self._extract(indexed['webpage_url'])
+        except ResolveError as e:
+            # Transient failures keep the entry, the resolution fails and is tried again later
+            if not e.unavailable:
+                raise
+            # Indexed video is gone (removed, private, region locked), search again
+            if self.debug_mode:
+                print('Resolver._resolve_indexed | {}'.format(format_exc()))
+            await loop.run_in_executor(None, self.index.forget, key)
+            return None
+        if isinstance(song_info, list):
+            return song_info[:1] or None
+        return [song_info] if song_info else None
+
+    async def resolve_flat(self, link: str, guild_id: Union[int, str] = None) -> ResolveResult:
+        """
+            Lists a playlist's entries without resolving them, single videos are resolved as usual
+                Lets a large playlist start playing without waiting on every entry's format extraction
+
+        :param link:        link: str
+        :param guild_id:    Discord Guild ID the songs are for: Union[int, str]
+        :return:            typed outcome, song_info is a song info dict if link is a single video
+                            or a list of {"url", "title", "duration"} entries if link is a playlist: ResolveResult
+        """
+        result = await self._request(('flat', SongCache.normalize(link)), self._resolve_flat, link, guild_id,
+                                     Priority.NOW_PLAYING)
+        if isinstance(result.song_info, list):
+            # Callers get their own copy of the shared entry list
+            return ResolveResult(result.query, result.status, list(result.song_info), result.error)
+        return result
+
+    async def _resolve_flat(self, link: str) -> Union[dict, List[str]]:
+        """
+            Runs the flat playlist extraction on a worker
+
+        :param link:    link: str
+        :return:        song info dict if link is a single video
+                        list of {"url", "title", "duration"} entries if link is a playlist
+        """
+        song_info = await self._extract(link, flat=True)
+        if not isinstance(song_info, list):
+            self._stamp_expiry(song_info)
+            self.cache.put(link, song_info)
+            return song_info
+        # Unavailable videos are listed as None or without a link
+        return [{'url': entry.get('webpage_url') or entry['url'],
+                 'title': entry.get('title'),
+                 'duration': entry.get('duration')}
+                for entry in song_info if entry and (entry.get('webpage_url') or entry.get('url'))]
+
+    async def _extract(self, query: str, flat: bool = False) -> Union[dict, List[dict]]:
+        """
+            Runs youtube_dl extraction on a worker, bypassing the cache
+                Failed attempts are retried with capped exponential backoff, the caller's deadline bounds the total.
+                A worker already running an attempt finishes it even if the deadline passes, its result is dropped.
+                The worker only counts as free again once the attempt actually returns.
+
+        :param query:   link or search keywords: str
+        :param flat:    only list playlist entries: bool
+        :return:        song info dict
+                        list of song info dicts if link is a playlist or search
+        """
+        loop = asyncio.get_running_loop()
+        error = None
+        for attempt in range(self.retries):
+            if attempt:
+                await asyncio.sleep(min(self.max_backoff, self.backoff * 2 ** (attempt - 1)))
+            await self._acquire_worker(_flight_priority.get([Priority.NOW_PLAYING]))
+            try:
+                future = self.executor.submit(extract_info, query, self.ydl_opts, self.debug_mode,
+                                              self.recycle_after, flat)
+            except BaseException:
+                self._release_worker()
+                raise
+            future.add_done_callback(lambda _: self._release_worker_threadsafe(loop))
+            try:
+                song_info = await asyncio.wrap_future(future)
+            except Exception as e:
+                error = e
+                continue
+            if song_info:
+                return song_info
+            error = None
+        if error is None:
+            raise ResolveError(f'Nothing found for "{query}"', unavailable=True)
+        message = str(error)
+        raise ResolveError(message, unavailable=any(part in message.lower() for part in UNAVAILABLE_ERRORS)) \
+            from error
+
+    async def _acquire_worker(self, priority: List[Priority]) -> None:
+        """
+            Waits until a worker is free for an extraction
+
+        :param priority:    mutable [Priority] of the extraction: List[Priority]
+        :return:            None
+        """
+        if self._free_workers and not self._worker_waiters:
+            self._free_workers -= 1
+            return
+        waiter = [priority, time.monotonic(), asyncio.get_running_loop().create_future()]
+        self._worker_waiters.append(waiter)
+        try:
+            await waiter[2]
+        except asyncio.CancelledError:
+            if waiter in self._worker_waiters:
+                self._worker_waiters.remove(waiter)
+            elif not waiter[2].cancelled():
+                # Worker was handed over just before the cancel, pass it on
+                self._release_worker()
+            raise
+
+    def _release_worker_threadsafe(self, loop: asyncio.AbstractEventLoop) -> None:
+        """
+            Releases a worker from the executor thread that finished its extraction
+
+        :param loop:    event loop the resolver runs on: asyncio.AbstractEventLoop
+        :return:        None
+        """
+        try:
+            loop.call_soon_threadsafe(self._release_worker)
+        except RuntimeError:
+            # Event loop was closed during shutdown
+            pass
+
+    def _release_worker(self) -> None:
+        """
+            Hands a finished extraction's worker to the most urgent waiting extraction
+                Waiting time counts toward urgency, `aging` seconds of waiting are worth one priority class
+
+        :return:    None
+        """
+        now = time.monotonic()
+        while self._worker_waiters:
+            waiter = min(self._worker_waiters, key=lambda w: (w[0][0] - (now - w[1]) / self.aging, w[1]))
+            self._worker_waiters.remove(waiter)
+            # Skip extractions cancelled while waiting
+            if not waiter[2].done():
+                waiter[2].set_result(None)
+                return
+        self._free_workers += 1
+
+    def shutdown(self) -> None:
+        """
+            Stops the worker pool and closes the query index, pending extractions are dropped
+
+        :return:    None
+        """
+        for flight in self._in_flight.values():
+            flight[0].cancel()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        if self.index:
+            self.index.close()
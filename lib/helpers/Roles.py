@@ -15,8 +15,7 @@ class RoleHandler:
         :param bot:     bot client: Bot
         :return:        None
         """
-        config = ConfigUtil().read_config('BOT_SETTINGS')
-        roleName = config['dj_role_name']
+        roleName = ConfigUtil.get_bot_settings().dj_role_name
         for guild in bot.guilds:
             # Skip guilds that have the role
             if roleName in (role.name for role in guild.roles):
@@ -0,0 +1,358 @@
+# SettingsStore.py
+
+import sqlite3
+
+from abc import ABC, abstractmethod
+from json import loads, dumps
+from typing import Optional
+from rebel import Database, PgsqlDriver, SqliteDriver
+from lib.helpers.ConnectionPool import ConnectionPool
+
+BOT_SETTINGS_COLUMNS = """
+    invite_link,
+    doom_playlist,
+    ydl_opts,
+    ffmpeg_opts,
+    embed_theme,
+    queue_display_length,
+    default_prefix,
+    view_timeout,
+    dj_role_name,
+    broken,
+    debug_mode
+"""
+
+
+class SettingsStore(ABC):
+    """
+        Storage backend for bot and server settings
+
+        Both backends share the "primary-config" / "server-settings" schema, one row per guild keyed by guild_id.
+        All methods are blocking and are run on ConfigUtil's DB executor.
+    """
+
+    # Schema prefix of the settings tables
+    schema = ''
+
+    def __init__(self, pool: ConnectionPool):
+        self.pool = pool
+
+    @property
+    def server_table(self) -> str:
+        return f'{self.schema}"server-settings"'
+
+    @property
+    def config_table(self) -> str:
+        return f'{self.schema}"primary-config"'
+
+    def query_bot_settings(self) -> Optional[dict]:
+        """
+            Reads the active bot settings row
+
+        :return:    BOT_SETTINGS dict, None if there is no active row: dict
+        """
+        with self.pool.connection() as db:
+            return db.query_one(f"""
+                SELECT {BOT_SETTINGS_COLUMNS}
+                FROM {self.config_table}
+                WHERE active = true
+            """)
+
+    def query_server_settings(self) -> dict:
+        """
+            Reads settings of every guild
+
+        :return:    {guild_id: {"prefix": str, "loop": bool}}: dict
+        """
+        with self.pool.connection() as db:
+            q_data = db.query(f"""
+                SELECT
+                    guild_id,
+                    prefix,
+                    loop
+                FROM {self.server_table}
+            """)
+        return {str(i['guild_id']): {
+            "prefix": i['prefix'],
+            "loop": bool(i['loop'])
+        } for i in q_data}
+
+    def query_guild(self, guild_id: str) -> Optional[dict]:
+        """
+            Reads a single guild's settings
+
+        :param guild_id:    Discord Guild ID: str
+        :return:            {"prefix": str, "loop": bool}, None if the guild has no settings: dict
+        """
+        with self.pool.connection() as db:
+            row = db.query_one(f"""
+                SELECT
+                    prefix,
+                    loop
+                FROM {self.server_table}
+                WHERE guild_id = ?
+            """, guild_id)
+        return {"prefix": row['prefix'], "loop": bool(row['loop'])} if row else None
+
+    def write_guilds(self, batch: dict) -> None:
+        """
+            Upserts/deletes several guilds' settings in a single transaction
+
+        :param batch:   {guild_id: settings or None to delete}: dict
+        :return:        None
+        """
+        with self.pool.connection() as db:
+            with db.transaction():
+                for guild_id, settings in batch.items():
+                    if settings is None:
+                        db.execute(f"""
+                            DELETE FROM {self.server_table}
+                                WHERE guild_id = ?;
+                        """, guild_id)
+                    else:
+                        db.execute(f"""
+                            INSERT INTO {self.server_table}(
+                                guild_id, prefix, loop)
+                            VALUES (?, ?, ?)
+                            ON CONFLICT (guild_id) DO UPDATE
+                                SET prefix = EXCLUDED.prefix, loop = EXCLUDED.loop;
+                        """, guild_id, settings['prefix'], settings['loop'])
+
+    @abstractmethod
+    def migrate(self) -> None:
+        """
+            Brings the schema up to date, collapsing duplicate guild rows into one
+
+        :return:    None
+        """
+
+    def close(self) -> None:
+        """
+            Closes all pooled connections
+
+        :return:    None
+        """
+        self.pool.close()
+
+
+class PostgresSettingsStore(SettingsStore):
+    """
+        Settings stored on the Postgres server set in 'DBConnection'
+    """
+
+    schema = 'public.'
+
+    def __init__(self, connection: dict):
+        def factory() -> Database:
+            return Database(PgsqlDriver(
+                host=connection['host'],
+                port=connection['port'],
+                database=connection['database'],
+                user=connection['user'],
+                password=connection['password']
+            ))
+
+        super().__init__(ConnectionPool(factory,
+                                        size=connection.get('pool_size', 4),
+                                        timeout=connection.get('pool_timeout', 10),
+                                        health_check_interval=connection.get('health_check_interval', 30)))
+
+    def migrate(self) -> None:
+        """
+            Collapses duplicate rows left by the old append-only writes and adds the unique guild_id index that
+            upserts rely on. Skipped if the index already exists.
+
+            The table has no timestamp or serial column, so the row written by the most recent transaction
+            (youngest xmin) wins. Rows with the same xmin (written together, or frozen by VACUUM) are ordered by
+            physical position, which is arbitrary rather than newest-first.
+
+        :return:    None
+        """
+        with self.pool.connection() as db:
+            if db.query_value("""
+                SELECT 1 FROM pg_indexes
+                WHERE schemaname = 'public' AND indexname = 'server_settings_guild_id_key'
+            """):
+                return
+            print("Migrating server-settings to one row per guild")
+            with db.transaction():
+                db.execute("""
+                    DELETE FROM public."server-settings" older
+                        USING public."server-settings" newer
+                    WHERE older.guild_id = newer.guild_id
+                        AND (age(older.xmin) > age(newer.xmin)
+                             OR (age(older.xmin) = age(newer.xmin) AND older.ctid < newer.ctid));
+                """)
+                db.execute("""
+                    CREATE UNIQUE INDEX server_settings_guild_id_key
+                        ON public."server-settings" (guild_id);
+                """)
+
+
+class WalSqliteDriver(SqliteDriver):
+    """
+        rebel SQLite driver using write-ahead logging
+
+        Connections may be used from any DB executor thread, the pool makes sure only one thread uses each at a time
+    """
+
+    def connect(self):
+        self.connection = sqlite3.connect(self.database, check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.autocommit = True
+
+
+class SqliteSettingsStore(SettingsStore):
+    """
+        Settings stored in a local SQLite file, for single machine deployments and offline benchmarks
+
+        A new file is filled from the local settings snapshot (see ConfigUtil.load_snapshot) if one is given,
+        e.g. the snapshot left behind by a bot that ran on Postgres
+    """
+
+    def __init__(self, options: dict, seed: Optional[dict] = None):
+        """
+        :param options:     'SQLite' section of app-settings.json: dict
+        :param seed:        {'BOT_SETTINGS': dict, 'SERVER_SETTINGS': dict} to fill a new file with: dict
+        """
+        path = options.get('path', 'jam-bot.sqlite3')
+        super().__init__(ConnectionPool(lambda: Database(WalSqliteDriver(path)),
+                                        size=options.get('pool_size', 4),
+                                        timeout=options.get('pool_timeout', 10),
+                                        health_check_interval=options.get('health_check_interval', 30)))
+        self._create_tables()
+        if seed:
+            self._seed(seed)
+
+    def _create_tables(self) -> None:
+        """
+            Creates the settings tables if the file is new
+
+        :return:    None
+        """
+        with self.pool.connection() as db:
+            db.execute("""
+                CREATE TABLE IF NOT EXISTS "primary-config" (
+                    invite_link TEXT,
+                    doom_playlist TEXT,
+                    ydl_opts TEXT,
+                    ffmpeg_opts TEXT,
+                    embed_theme INTEGER,
+                    queue_display_length INTEGER,
+                    default_prefix TEXT,
+                    view_timeout INTEGER,
+                    dj_role_name TEXT,
+                    broken BOOLEAN,
+                    debug_mode BOOLEAN,
+                    active BOOLEAN
+                );
+            """)
+            db.execute("""
+                CREATE TABLE IF NOT EXISTS "server-settings" (
+                    guild_id TEXT NOT NULL,
+                    prefix TEXT,
+                    loop BOOLEAN
+                );
+            """)
+
+    def _seed(self, snapshot: dict) -> None:
+        """
+            Fills the settings tables from a settings snapshot if they are still empty
+
+        :param snapshot:    {'BOT_SETTINGS': dict, 'SERVER_SETTINGS': dict}: dict
+        :return:            None
+        """
+        bot_settings = snapshot.get('BOT_SETTINGS')
+        server_settings = snapshot.get('SERVER_SETTINGS') or {}
+        if not bot_settings:
+            return
+        columns = [column.strip() for column in BOT_SETTINGS_COLUMNS.split(',')]
+        with self.pool.connection() as db:
+            if db.query_value('SELECT 1 FROM "primary-config" LIMIT 1') \
+                    or db.query_value('SELECT 1 FROM "server-settings" LIMIT 1'):
+                return
+            print("Seeding the SQLite settings store from the settings snapshot")
+            with db.transaction():
+                values = [dumps(bot_settings.get(column)) if column in ('ydl_opts', 'ffmpeg_opts')
+                          else bot_settings.get(column) for column in columns]
+                db.execute(f"""
+                    INSERT INTO "primary-config"({BOT_SETTINGS_COLUMNS}, active)
+                    VALUES ({', '.join('?' * len(columns))}, true);
+                """, *values)
+                for guild_id, settings in server_settings.items():
+                    db.execute("""
+                        INSERT INTO "server-settings"(guild_id, prefix, loop)
+                        VALUES (?, ?, ?);
+                    """, str(guild_id), settings.get('prefix'), settings.get('loop'))
+
+    def query_bot_settings(self) -> Optional[dict]:
+        """
+            Reads the active bot settings row, option columns are stored as JSON text
+
+        :return:    BOT_SETTINGS dict, None if there is no active row: dict
+        """
+        settings = super().query_bot_settings()
+        if settings is None:
+            print('No active row in "primary-config" of the SQLite settings store, '
+                  'start once with a settings snapshot next to the bot or insert the row manually')
+            return None
+        for column in ('ydl_opts', 'ffmpeg_opts'):
+            if isinstance(settings[column], str):
+                settings[column] = loads(settings[column])
+        settings['broken'] = bool(settings['broken'])
+        settings['debug_mode'] = bool(settings['debug_mode'])
+        return settings
+
+    def migrate(self) -> None:
+        """
+            Collapses duplicate guild rows (newest row wins) and adds the unique guild_id index
+
+        :return:    None
+        """
+        with self.pool.connection() as db:
+            if db.query_value("""
+                SELECT 1 FROM sqlite_master
+                WHERE type = 'index' AND name = 'server_settings_guild_id_key'
+            """):
+                return
+            with db.transaction():
+                db.execute("""
+                    DELETE FROM "server-settings"
+                    WHERE rowid NOT IN (
+                        SELECT MAX(rowid) FROM "server-settings" GROUP BY guild_id
+                    );
+                """)
+                db.execute("""
+                    CREATE UNIQUE INDEX server_settings_guild_id_key
+                        ON "server-settings" (guild_id);
+                """)
+
+
+def create_store(app_settings: dict, seed: Optional[dict] = None) -> Optional[SettingsStore]:
+    """
+        Builds the settings store selected by 'SettingsBackend' in app-settings.json
+
+    :param app_settings:    parsed app-settings.json: dict
+    :param seed:            settings snapshot a new SQLite file is filled with: dict
+    :return:                settings store, None if the selected backend is not configured: SettingsStore
+    """
+    backend = app_settings.get('SettingsBackend', 'postgres').lower()
+    if backend == 'sqlite':
+        return SqliteSettingsStore(app_settings.get('SQLite', {}), seed)
+    if backend == 'postgres' and app_settings.get('DBConnection'):
+        return PostgresSettingsStore(app_settings['DBConnection'])
+    print(f"Settings backend '{backend}' is not configured")
+    return None
+
+
+def backend_options(app_settings: dict) -> dict:
+    """
+        Gets the app-settings.json section of the selected settings backend
+
+    :param app_settings:    parsed app-settings.json: dict
+    :return:                backend options: dict
+    """
+    if app_settings.get('SettingsBackend', 'postgres').lower() == 'sqlite':
+        return app_settings.get('SQLite', {})
+    return app_settings.get('DBConnection', {})
@@ -0,0 +1,131 @@
+# Song.py
+
+from typing import Optional
+from nextcord import Member
+
+
+class Song:
+    """
+        Queued song
+
+        Unresolved songs only know the query they will be resolved from (search keywords or a link) and, for
+        lazily listed playlist entries, their title/duration. Resolving fills in the rest in place, so a song
+        keeps its identity and position while it is being resolved. The playback url's expiry is taken from the
+        song info when the song is resolved and stored with the song as is.
+    """
+    __slots__ = ('query', 'author', 'title', 'url', 'webpage_url', 'duration', 'thumbnail', 'expires_at', 'resolved')
+
+    def __init__(self, query: str, author: Member, title: Optional[str] = None, duration: Optional[int] = None):
+        """
+        :param query:       search keywords or link the song is resolved from: str
+        :param author:      member who requested the song: Member
+        :param title:       title if already known: str
+        :param duration:    duration in seconds if already known: int
+        """
+        self.query = query
+        self.author = author
+        self.title = title
+        self.duration = duration
+        self.url = None
+        self.webpage_url = None
+        self.thumbnail = None
+        self.expires_at = None
+        self.resolved = False
+
+    @classmethod
+    def from_song_info(cls, song_info: dict, author: Member) -> 'Song':
+        """
+            Builds a resolved song from youtube_dl song info
+
+        :param song_info:   dict from youtube_dl download: dict
+        :param author:      ctx.message.author: Member
+        :return:            resolved song: Song
+        """
+        song = cls(song_info['webpage_url'], author)
+        song.resolve(song_info)
+        return song
+
+    def resolve(self, song_info: dict) -> None:
+        """
+            Fills in playback info from youtube_dl song info
+                NOTE: In-place modification
+
+        :param song_info:   dict from youtube_dl download: dict
+        :return:            None
+        """
+        self.title = song_info['title']
+        self.url = song_info['url']
+        self.webpage_url = song_info['webpage_url']
+        self.duration = song_info['duration']
+        self.thumbnail = song_info['thumbnails'][-1]['url']
+        # Set by the resolver, unknown expiries are treated as expired when the queue is restored
+        self.expires_at = song_info.get('expires_at')
+        self.resolved = True
+
+    def expire(self) -> None:
+        """
+            Drops an expired playback url, the song is resolved again from its page
+                NOTE: In-place modification
+
+        :return:    None
+        """
+        self.url = None
+        self.expires_at = None
+        self.resolved = False
+        if self.webpage_url:
+            self.query = self.webpage_url
+
+    def is_fresh(self, fresh_until: float) -> bool:
+        """
+            Checks if the playback url outlives `fresh_until`, urls of unknown expiry count as fresh
+
+        :param fresh_until:     unix time the playback url has to outlive: float
+        :return:                song is resolved and its url is fresh: bool
+        """
+        return self.resolved and (self.expires_at is None or self.expires_at > fresh_until)
+
+    def to_record(self) -> list:
+        """
+            Compact form of the song for the queue store, the author is stored by id
+
+        :return:    [query, author id, title, webpage_url, duration, thumbnail, url, expires_at]: list
+        """
+        url, expires_at = (self.url, self.expires_at) if self.resolved else (None, None)
+        return [self.query, self.author.id, self.title, self.webpage_url, self.duration, self.thumbnail,
+                url, expires_at]
+
+    @classmethod
+    def from_record(cls, record: list, author: Member, fresh_until: float) -> 'Song':
+        """
+            Rebuilds a stored song
+                A playback url expiring before `fresh_until` is dropped, the song is then resolved again from its
+                page once it comes up
+
+        :param record:          song record from `to_record`: list
+        :param author:          member who requested the song: Member
+        :param fresh_until:     unix time stored playback urls have to outlive: float
+        :return:                song: Song
+        """
+        query, _, title, webpage_url, duration, thumbnail, url, expires_at = record
+        song = cls(query, author, title, duration)
+        song.webpage_url = webpage_url
+        song.thumbnail = thumbnail
+        if url is not None and expires_at is not None and expires_at > fresh_until:
+            song.url = url
+            song.expires_at = expires_at
+            song.resolved = True
+        elif webpage_url:
+            song.query = webpage_url
+        return song
+
+    @property
+    def display_title(self) -> str:
+        """
+            Title to show in embeds, the query until the song is resolved
+
+        :return:    title: str
+        """
+        return self.title or self.query
+
+    def __repr__(self) -> str:
+        return f'Song({self.display_title!r}, resolved={self.resolved})'
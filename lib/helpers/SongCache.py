@@ -0,0 +1,161 @@
+# SongCache.py
+
+import re
+import time
+
+from collections import OrderedDict
+from typing import Optional, Union, List
+from urllib.parse import urlparse, parse_qs
+
+
+class CachedSong:
+    """
+        Resolved song info split into stable metadata and the expiring playback url
+    """
+    __slots__ = ('title', 'webpage_url', 'duration', 'thumbnail', 'url', 'expires_at', 'as_list')
+
+    def __init__(self, song_info: dict, expires_at: float, as_list: bool):
+        self.title = song_info['title']
+        self.webpage_url = song_info['webpage_url']
+        self.duration = song_info['duration']
+        self.thumbnail = song_info['thumbnails'][-1]['url']
+        self.url = song_info['url']
+        self.expires_at = expires_at
+        self.as_list = as_list
+
+    def to_song_info(self) -> Union[dict, List[dict]]:
+        """
+            Rebuilds song info in the shape the resolver originally returned
+
+        :return:    song info dict, or a single item list for search results: Union[dict, List[dict]]
+        """
+        song_info = {'title': self.title,
+                     'url': self.url,
+                     'webpage_url': self.webpage_url,
+                     'duration': self.duration,
+                     'thumbnails': [{'url': self.thumbnail}],
+                     'expires_at': self.expires_at}
+        return [song_info] if self.as_list else song_info
+
+
+class SongCache:
+    """
+        LRU cache of resolved songs keyed by normalized query/URL
+
+        Stable metadata is kept until the entry is evicted, the playback url only until the expiry embedded in the
+        googlevideo url (or `stream_ttl` seconds if it has none)
+    """
+
+    def __init__(self, max_size: int = 2048, stream_ttl: float = 3600, refresh_margin: float = 600):
+        """
+        :param max_size:        max cached songs: int
+        :param stream_ttl:      playback url lifetime if the url carries no expiry (seconds): float
+        :param refresh_margin:  playback urls expiring sooner than this count as stale (seconds): float
+        """
+        self.max_size = max(1, max_size)
+        self.stream_ttl = stream_ttl
+        self.refresh_margin = refresh_margin
+        self._songs = OrderedDict()
+
+    @staticmethod
+    def normalize(query: str) -> str:
+        """
+            Normalizes a query so equivalent searches share a cache entry
+                URLs keep their case, video ids are case-sensitive
+
+        :param query:   link or search keywords: str
+        :return:        cache key: str
+        """
+        query = ' '.join(query.split())
+        return query if SongCache.is_url(query) else query.lower()
+
+    @staticmethod
+    def is_url(query: str) -> bool:
+        """
+            Checks if a query is a link rather than search keywords
+
+        :param query:   link or search keywords: str
+        :return:        query is a link: bool
+        """
+        return query.lstrip().startswith(('http://', 'https://'))
+
+    def get(self, query: str) -> Optional[CachedSong]:
+        """
+            Looks up a cached song, marking it as recently used
+
+        :param query:   link or search keywords: str
+        :return:        cached song, None on a miss: CachedSong
+        """
+        key = self.normalize(query)
+        song = self._songs.get(key)
+        if song is not None:
+            self._songs.move_to_end(key)
+        return song
+
+    def put(self, query: str, song_info: Union[dict, List[dict]]) -> None:
+        """
+            Caches a resolved single song, playlists and incomplete info are skipped
+
+        :param query:       link or search keywords: str
+        :param song_info:   song info dict or list of song info dicts from youtube_dl: Union[dict, List[dict]]
+        :return:            None
+        """
+        as_list = isinstance(song_info, list)
+        if as_list:
+            if len(song_info) != 1:
+                return
+            song_info = song_info[0]
+        try:
+            song = CachedSong(song_info, song_info.get('expires_at') or self.stream_expiry(song_info['url']), as_list)
+        except (KeyError, IndexError, TypeError):
+            return
+
+        key = self.normalize(query)
+        self._songs[key] = song
+        self._songs.move_to_end(key)
+        while len(self._songs) > self.max_size:
+            self._songs.popitem(last=False)
+
+    def is_fresh(self, song: CachedSong) -> bool:
+        """
+            Checks if a cached song's playback url is usable for a whole playthrough
+
+        :param song:    cached song: CachedSong
+        :return:        playback url is not near expiry: bool
+        """
+        margin = max(self.refresh_margin, song.duration or 0)
+        return song.expires_at - time.time() > margin
+
+    def refresh_stream(self, song: CachedSong, song_info: Union[dict, List[dict]]) -> None:
+        """
+            Replaces only the playback url of a cached song
+
+        :param song:        cached song: CachedSong
+        :param song_info:   freshly extracted song info: Union[dict, List[dict]]
+        :return:            None
+        """
+        if isinstance(song_info, list):
+            song_info = song_info[0]
+        song.url = song_info['url']
+        song.expires_at = self.stream_expiry(song.url)
+
+    def stream_expiry(self, url: str) -> float:
+        """
+            Reads the expiry time embedded in a googlevideo playback url
+
+        :param url:     playback url: str
+        :return:        unix time the url expires: float
+        """
+        parsed = urlparse(url)
+        expire = parse_qs(parsed.query).get('expire')
+        if not expire:
+            # Manifest urls carry the expiry as a path segment instead
+            match = re.search(r'/expire/(\d+)', parsed.path)
+            expire = [match.group(1)] if match else None
+        try:
+            return float(expire[0])
+        except (TypeError, ValueError):
+            return time.time() + self.stream_ttl
+
+    def __len__(self) -> int:
+        return len(self._songs)
@@ -1,15 +1,22 @@
 # SongQueue.py
 
-import nextcord
 import asyncio
+import time
 
-from typing import List, Union, Tuple
-from nextcord import Member
+from typing import List, Union, Tuple, Awaitable, Iterable, Callable, Any
 from nextcord.ext.commands import Bot, Context
 from lib.helpers.Utils import Util, ConfigUtil
 from lib.helpers.Embeds import Embeds
+from lib.helpers.BotSettings import BotSettings
 from lib.helpers.SpotifyParser import SpotifyParser
 from lib.helpers.SoundCloudParser import SoundcloudParser
+from lib.helpers.Prefetcher import Prefetcher
+from lib.helpers.Song import Song
+from lib.helpers.GuildQueue import GuildQueue
+from lib.helpers.GuildPlayer import GuildPlayer
+from lib.helpers.QueueStore import QueueStore
+from lib.helpers.ResolutionScheduler import ResolutionScheduler
+from lib.helpers.Resolver import ResolveResult, ResolveStatus
 from traceback import format_exc
 
 
@@ -20,17 +27,33 @@ class SongQueue:
         Handles control functions of server song queues
     """
 
-    def __init__(self, bot: Bot):
+    def __init__(self, bot: Bot, settings: BotSettings, utilities: Util, embeds: Embeds):
         self.bot = bot
-        self.utilities = Util()
-        self.embeds = Embeds(self.bot)
+        self.utilities = utilities
+        self.embeds = embeds
         self.server_queues = {}
+        self.players = {}
+        self.prefetcher = Prefetcher(utilities, self.run_on_player,
+                                     ConfigUtil.app_settings().get('Prefetch', {}).get('depth', 2))
+        self.scheduler = ResolutionScheduler(utilities, self.run_on_player,
+                                             ConfigUtil.app_settings().get('Scheduler', {}).get('workers', 4),
+                                             utilities.resolver.aging)
 
         # Get config values
         self.config_obj = ConfigUtil()
-        self.config = self.config_obj.read_config('BOT_SETTINGS')
-        self.ffmpeg_opts = self.config['ffmpeg_opts']
-        self.default_prefix = self.config['default_prefix']
+        self.config = settings
+        self.ffmpeg_opts = settings.ffmpeg_opts
+        self.default_prefix = settings.default_prefix
+
+        # Queue snapshots, changed queues are saved by the tasks cog and every queue once per `full_interval`
+        store_settings = ConfigUtil.app_settings().get('QueueStore', {})
+        store_path = store_settings.get('path', 'queue-store.sqlite3')
+        self.store = QueueStore(store_path, settings.debug_mode) if store_path else None
+        self.full_snapshot_interval = store_settings.get('full_interval', 300)
+        self._changed = set()
+        self._last_full_snapshot = time.monotonic()
+        # Stored queues were restored, snapshots before that would overwrite them with empty queues
+        self._restored = False
 
         # Call create server queue on creation to populate object with queues for previously connected servers
         self.create_server_queue()
@@ -48,66 +71,209 @@ class SongQueue:
             g_id = str(guild.id)
             # Add guild id to queue dict
             if g_id not in self.server_queues:
-                self.server_queues[g_id] = []
+                self.server_queues[g_id] = GuildQueue()
 
-    def get_queue(self, guild_id: int) -> List[tuple]:
+    def get_queue(self, guild_id: int) -> GuildQueue:
         """
             Get Server Queue from Queue Dict
 
         :param guild_id:    guild id int
-        :return:            Guild song queue list
+        :return:            Guild song queue
         """
         return self.server_queues[str(guild_id)]
 
-    def clear_queue(self, guild_id: int) -> None:
+    def player(self, guild_id: int) -> GuildPlayer:
+        """
+            Get the player owning a guild's song queue, all queue changes go through it
+
+        :param guild_id:    Discord Guild ID: int
+        :return:            Guild player: GuildPlayer
+        """
+        g_id = str(guild_id)
+        if g_id not in self.players:
+            self.players[g_id] = GuildPlayer(self, g_id)
+        return self.players[g_id]
+
+    async def run_on_player(self, guild_id: Union[int, str], command: Callable[[], Any]) -> Any:
+        """
+            Runs a queue change on the guild's player, the queue is flagged for the next snapshot
+
+        :param guild_id:    Discord Guild ID: Union[int, str]
+        :param command:     function or coroutine function without arguments: Callable[[], Any]
+        :return:            what the command returned
+        """
+        return await self.player(guild_id).run(command)
+
+    async def clear_queue(self, guild_id: int) -> None:
         """
             Clear Guilds song queue
 
         :param guild_id:    Discord Guild ID: int
         :return:            None
         """
-        self.server_queues[str(guild_id)].clear()
+        # Cancel right away, a resolution the player is waiting on would hold up the clear
+        self.prefetcher.cancel(guild_id)
+        self.scheduler.cancel(guild_id)
+        self.utilities.resolver.cancel_guild(guild_id)
+
+        def clear() -> None:
+            self.scheduler.cancel(guild_id)
+            self.server_queues[str(guild_id)].clear()
+
+        await self.player(guild_id).run(clear)
+
+    def mark_changed(self, guild_id: Union[int, str]) -> None:
+        """
+            Flags a guild's queue for the next snapshot
+
+        :param guild_id:    Discord Guild ID: Union[int, str]
+        :return:            None
+        """
+        self._changed.add(str(guild_id))
+
+    async def save_queues(self) -> None:
+        """
+            Snapshots changed queues to the queue store, every queue once per `full_snapshot_interval`
+                Songs resolved in the background don't flag their queue, the full snapshot picks them up
+
+        :return:    None
+        """
+        if self.store is None:
+            return
+        if time.monotonic() - self._last_full_snapshot >= self.full_snapshot_interval:
+            self._last_full_snapshot = time.monotonic()
+            self._changed.update(g_id for g_id, queue in self.server_queues.items() if queue)
+        if not self._changed:
+            return
+
+        changed, self._changed = self._changed, set()
+        if not await asyncio.get_running_loop().run_in_executor(None, self.store.save, self._snapshot(changed)):
+            # Retry with the next snapshot
+            self._changed.update(changed)
+
+    def _snapshot(self, guild_ids: Iterable[str]) -> dict:
+        """
+            Builds the stored form of guilds' queues
+
+        :param guild_ids:   Discord Guild IDs: Iterable[str]
+        :return:            {guild_id: [song record, ...]}: dict
+        """
+        snapshot = {}
+        for g_id in guild_ids:
+            records = snapshot[g_id] = []
+            for song in self.server_queues.get(g_id, ()):
+                try:
+                    records.append(song.to_record())
+                except Exception:
+                    # Leave the song out instead of failing the whole snapshot
+                    if self.config.debug_mode:
+                        print('SongQueue._snapshot | {}'.format(format_exc()))
+        return snapshot
+
+    def close_store(self) -> None:
+        """
+            Writes a final snapshot of every queue and closes the queue store, call on unload or shutdown
+                Blocking, the event loop may already be gone
+
+        :return:    None
+        """
+        if self.store is None:
+            return
+        store, self.store = self.store, None
+        if self._restored:
+            self._changed.update(g_id for g_id, queue in self.server_queues.items() if queue)
+            store.save(self._snapshot(self._changed))
+            self._changed = set()
+        store.close()
+
+    async def restore_queues(self) -> None:
+        """
+            Restores the queues stored before the last shutdown or crash
+                Playback urls close to expiry are dropped, those songs are resolved again once they come up
+
+        :return:    None
+        """
+        if self.store is None:
+            return
+        try:
+            stored = await asyncio.get_running_loop().run_in_executor(None, self.store.load)
+        except Exception:
+            print("Failed to read stored queues, starting with empty queues")
+            if self.config.debug_mode:
+                print('SongQueue.restore_queues | {}'.format(format_exc()))
+            stored = {}
+        fresh_until = time.time() + self.utilities.resolver.cache.refresh_margin
+        restored = 0
+        for guild in self.bot.guilds:
+            records = stored.get(str(guild.id))
+            try:
+                if not records or self.get_queue(guild.id):
+                    continue
+                songs = []
+                for record in records:
+                    try:
+                        # Members who left the guild are replaced by the bot
+                        songs.append(Song.from_record(record, guild.get_member(record[1]) or guild.me, fresh_until))
+                    except (TypeError, ValueError, IndexError, KeyError):
+                        print(f"Skipping unreadable stored song in guild {guild.id}: {record!r}")
+                if songs:
+                    await self.add_queue(guild.id, songs)
+                    restored += len(songs)
+            except Exception:
+                # A broken queue must not keep the other guilds' queues (and the snapshot task) from starting
+                print(f"Failed to restore the queue of guild {guild.id}")
+                if self.config.debug_mode:
+                    print('SongQueue.restore_queues | {}'.format(format_exc()))
+        self._restored = True
+        if restored:
+            print(f"\tRestored {restored} queued songs")
+
+    def prefetch_next(self, guild_id: int) -> None:
+        """
+            Starts resolving the songs after the current one, call whenever the head of the queue changes
+
+        :param guild_id:    Discord Guild ID: int
+        :return:            None
+        """
+        self.prefetcher.retarget(guild_id, self.get_queue(guild_id))
 
-    def add_queue(self, guild_id: int, song_set: Union[list, tuple], queue_position: int = None) -> None:
+    async def add_queue(self, guild_id: int, song_set: Union[List[Song], Song], queue_position: int = None) -> None:
         """
             Helper function
             Add song to Server Queue in Queue Dict
 
         :param guild_id:        guild id: int
-        :param song_set:        song tuple / list of song tuples: Union[list, tuple]
+        :param song_set:        song / list of songs: Union[List[Song], Song]
         :param queue_position:  position to add the song/songs to: int
         :return:                None
         """
-        if not queue_position:
-            # normally, we add the song to the end of the queue
-            if type(song_set) == list:
-                [self.server_queues[str(guild_id)].append(i) for i in song_set]
-            else:
-                self.server_queues[str(guild_id)].append(song_set)
-        else:
-            # we can also insert the song in the queue
-            if type(song_set) == list:
-                self.server_queues[str(guild_id)][1:1] = song_set
+        songs = song_set if type(song_set) == list else [song_set]
+
+        def add() -> None:
+            queue = self.server_queues[str(guild_id)]
+            if not queue_position:
+                # normally, we add the song to the end of the queue
+                queue.extend(songs)
             else:
-                self.server_queues[str(guild_id)].insert(1, song_set)
+                # we can also insert the song after the current song
+                queue.insert_next(songs)
+                # The songs after the current one changed, prefetch the new ones
+                if len(queue) > len(songs):
+                    self.prefetch_next(guild_id)
 
-    async def add_song_to_queue(self, ctx: Context, song_info: Union[list, tuple, dict], from_youtube: bool = True,
-                                queue_position: int = None) -> None:
+        await self.player(guild_id).run(add)
+
+    async def add_song_to_queue(self, ctx: Context, song_info: Union[List[Song], List[dict], dict],
+                                from_youtube: bool = True, queue_position: int = None) -> None:
         """
             Add song(s) to queue
 
-            If a song is from youtube, its song info should added to the queue from youtube in the following format
-                song = tuple:(title: string,
-                              url: string,
-                              web_page: string,
-                              ctx.message.author: string,
-                              duration: int,
-                              thumbnail: string)
-            If a song is from another source (Spotify, Soundcloud, etc.), the its song info
-            should added to the queue from youtube in the following format:
-                song = "{song title} {artist}"
-
-                The song will then be downloaded from youtube when it is played.
+            If a song is from youtube, it is added to the queue as a resolved Song built from its song info.
+            If a song is from another source (Spotify, Soundcloud, etc.) or a lazily listed playlist entry,
+            it is added as an unresolved Song holding its search keywords/link:
+                Song("{song title} {artist}", author)
+
+                The song will then be downloaded from youtube in the background or when it is played.
                 NOTE: this means the song webpage/thumbnail url will not be available until then
 
         :param ctx:             context command was invoked under: Context
@@ -115,7 +281,7 @@ class SongQueue:
                                 if link is a playlist AND youtube link
                                     list of song info dicts from youtube dl
                                 if link is from a NON-youtube source
-                                    list of str: [f"{song title} {artist}", ...]
+                                    list of unresolved songs: List[Song]
         :param from_youtube:    if link was a youtube link: bool
         :param queue_position:  position to insert into song queue: int
         :return:                None
@@ -123,16 +289,16 @@ class SongQueue:
         if from_youtube:
             # If link was a playlist, loop through list of songs and add them to the queue
             if type(song_info) == list:
-                song_list = [self.utilities.song_info_to_tuple(i, ctx.message.author) for i in song_info]
-                self.add_queue(ctx.guild.id, song_list, queue_position)
+                song_list = [Song.from_song_info(i, ctx.message.author) for i in song_info]
+                await self.add_queue(ctx.guild.id, song_list, queue_position)
                 if (len(song_info)) > 1 or ctx.guild.voice_client.is_playing():
                     await ctx.channel.send(
                         embed=self.embeds.generate_added_queue_embed(ctx, song_list),
                         delete_after=40)
             # Otherwise add the single song to the queue, display message if song was added to the queue
             else:
-                # Generate song tuple
-                song = self.utilities.song_info_to_tuple(song_info, ctx.message.author)
+                # Generate song
+                song = Song.from_song_info(song_info, ctx.message.author)
 
                 # Display added to queue if queue is not empty
                 if len(self.get_queue(ctx.guild.id)) >= 1:
@@ -141,11 +307,13 @@ class SongQueue:
                         delete_after=40)
 
                 # add song to queue for playback
-                self.add_queue(ctx.guild.id, song, queue_position)
+                await self.add_queue(ctx.guild.id, song, queue_position)
         else:
             # Create song list, add songs to server queue, display message
-            song_list = [i for i in song_info]
-            self.add_queue(ctx.guild.id, song_list, queue_position)
+            song_list = list(song_info)
+            await self.add_queue(ctx.guild.id, song_list, queue_position)
+            # Resolve the added songs in the background
+            self.scheduler.submit(ctx.guild.id, self.get_queue(ctx.guild.id), song_list)
             if (len(song_info)) > 1 or ctx.guild.voice_client.is_playing():
                 await ctx.channel.send(
                     embed=self.embeds.generate_added_queue_embed(ctx, song_list),
@@ -154,65 +322,64 @@ class SongQueue:
     async def play_music_(self, ctx: Context) -> None:
         """
             Play songs in server's queue
+                Starts the song at the head of the queue on the guild's player, later songs follow on their own
 
         :param ctx:     context command was invoked under: Context
         :return:        None
         """
-        try:
-            # Get voice client
-            vc = ctx.guild.voice_client
-            # Get server song queue
-            song_queue = self.get_queue(ctx.guild.id)
+        player = self.player(ctx.guild.id)
+        player.ctx = ctx
+        player.send(player.play_next)
 
-            while song_queue:
-                try:
-                    if vc.is_connected() and not vc.is_playing():
-                        song_url = self.utilities.get_first_in_queue(song_queue)
-                        # Create FFmpeg audio stream, attach to voice client
-                        vc.play(nextcord.FFmpegPCMAudio(song_url, **self.ffmpeg_opts))
-                        vc.source = nextcord.PCMVolumeTransformer(vc.source)
-                        vc.volume = 1
-
-                        # Display now playing message
-                        await ctx.invoke(self.bot.get_command('np'))
-
-                except nextcord.errors.ClientException:
-                    print(f"ClientException: Failed to Play Song in {ctx.guild.name}")
-                    break
-
-                # Pause function while playing song, prevents rapid song switching
-                while vc.is_playing():
-                    await asyncio.sleep(1)
-
-                server_settings = self.config_obj.read_config("SERVER_SETTINGS")
-                # Move to next song in queue once song is finished if loop is disabled
-                if song_queue and not server_settings[str(ctx.guild.id)]['loop']:
-                    del song_queue[0]
-                # Move current song to the end of queue if loop is enabled
-                elif song_queue and server_settings[str(ctx.guild.id)]['loop']:
-                    song_temp = song_queue[0]
-                    song_queue.append(song_temp)
-                    del song_queue[0]
-
-            # if queue is empty and bot is not playing, timeout bot
-            await asyncio.sleep(180)
-            if not song_queue and not vc.is_playing():
-                # Disconnect bot
-                await ctx.invoke(self.bot.get_command('disconnect'))
-                # Make sure queue is cleared
-                self.clear_queue(ctx.guild.id)
-                # Turn off song loop in guild settings
-                server_settings = self.config_obj.read_config("SERVER_SETTINGS")
-                server = server_settings[str(ctx.guild.id)]
-                server['loop'] = False
-                self.config_obj.write_config('w', 'SERVER_SETTINGS', str(ctx.guild.id), server)
-
-        except nextcord.DiscordException:
-            if self.config['debug_mode']:
-                print('SongQueue.play_music | {}'.format(format_exc()))
+    async def skip_songs(self, guild_id: int, num: int = 1) -> None:
+        """
+            Skip the current song and the `num - 1` songs after it
 
-    @staticmethod
-    async def spotify_to_yt_dl(ctx: Context, link: str) -> Tuple[Union[dict, List[Tuple[str, Member]]], bool]:
+        :param guild_id:    Discord Guild ID: int
+        :param num:         number of songs to skip: int
+        :return:            None
+        """
+        # Cancel right away, a resolution the player is waiting on would hold up the skip
+        queue = self.get_queue(guild_id)
+        skipped = queue[:num if len(queue) >= num else 1]
+        self.prefetcher.cancel(guild_id)
+        # Forget the skipped songs first so their cancelled resolutions are not re-submitted
+        self.scheduler.drop(skipped)
+        self.utilities.resolver.cancel_guild(guild_id, skipped)
+
+        player = self.player(guild_id)
+        await player.run(lambda: player.skip(num))
+
+    async def shuffle_queue(self, guild_id: int, start: int = 1) -> None:
+        """
+            Shuffle guild's song queue
+
+        :param guild_id:    Discord Guild ID: int
+        :param start:       first position to shuffle, 1 keeps the current song in place: int
+        :return:            None
+        """
+        def shuffle() -> None:
+            self.get_queue(guild_id).shuffle(start)
+            self.prefetch_next(guild_id)
+
+        await self.player(guild_id).run(shuffle)
+
+    async def remove_song(self, guild_id: int, song: Song) -> bool:
+        """
+            Remove a song from guild's song queue
+
+        :param guild_id:    Discord Guild ID: int
+        :param song:        song to remove: Song
+        :return:            True if the song was still in the queue: bool
+        """
+        def remove() -> bool:
+            removed = self.get_queue(guild_id).remove(song)
+            self.prefetch_next(guild_id)
+            return removed
+
+        return await self.player(guild_id).run(remove)
+
+    async def spotify_to_yt_dl(self, ctx: Context, link: str) -> Tuple[Union[dict, List[Song]], bool]:
         """
             Extract songs and artists from spotify playlist
             convert to song list
@@ -220,16 +387,15 @@ class SongQueue:
         :param ctx:     context command was invoked under: Context
         :param link:    link:  str
         :return:        song info from youtube if its a track: dict
-                        list of tuples if its a playlist
-                            ("{song title} {song artist}": str, ctx.message.author: Member): tuple
+                        list of unresolved songs if its a playlist
+                            Song("{song title} {song artist}", ctx.message.author): Song
 
         """
-        parser = SpotifyParser(ctx.message.author)
-        song_info, is_track = parser.parse_link(link)
+        parser = SpotifyParser(ctx.message.author, self.utilities)
+        song_info, is_track = await parser.parse_link(link)
         return song_info, is_track
 
-    @staticmethod
-    async def soundcloud_to_yt_dl(ctx: Context, link: str) -> Tuple[Union[dict, List[Tuple[str, Member]]], bool]:
+    async def soundcloud_to_yt_dl(self, ctx: Context, link: str) -> Tuple[Union[dict, List[Song]], bool]:
         """
             Extract songs and artists from soundcloud playlist
             convert to song list
@@ -237,14 +403,14 @@ class SongQueue:
         :param ctx:     context command was invoked under: Context
         :param link:    link: str
         :return:        song info from youtube if its a track: dict
-                        list of tuples if its a playlist
-                            ("{song title} {song artist}": str, ctx.message.author: Member): tuple
+                        list of unresolved songs if its a playlist
+                            Song("{song title} {song artist}", ctx.message.author): Song
         """
-        parser = SoundcloudParser(ctx.message.author)
-        song_info, track_flag = parser.parse_link(link)
+        parser = SoundcloudParser(ctx.message.author, self.utilities)
+        song_info, track_flag = await parser.parse_link(link)
         return song_info, track_flag
 
-    async def extract_song_info(self, ctx: Context, link: str) -> Tuple[Union[dict, List[dict], List[Tuple[str, Member]]], bool]:
+    async def extract_song_info(self, ctx: Context, link: str) -> Tuple[Union[dict, List[dict], List[Song]], bool]:
         """
             Directs link to proper parse method
 
@@ -264,6 +430,38 @@ class SongQueue:
         elif "https://soundcloud.com" in link:
             await ctx.channel.send("**SoundCloud Link!** This may take a moment...", delete_after=20)
             song_info, from_youtube = await self.soundcloud_to_yt_dl(ctx, link)
+        elif self.is_youtube_playlist(link):
+            # List entries now, entries are resolved as they come up or in the background
+            song_info = await self.resolve_or_report(ctx, self.utilities.resolver.resolve_flat(link, ctx.guild.id))
+            if isinstance(song_info, list):
+                song_info = [Song(entry['url'], ctx.message.author, entry['title'], entry['duration'])
+                             for entry in song_info]
+                from_youtube = False
         else:
-            song_info = self.utilities.download_from_yt(link)
+            song_info = await self.resolve_or_report(ctx, self.utilities.resolver.resolve(link, ctx.guild.id))
         return song_info, from_youtube
+
+    @staticmethod
+    async def resolve_or_report(ctx: Context, resolution: Awaitable[ResolveResult]) -> Union[dict, list, None]:
+        """
+            Awaits a resolution, telling the user when it did not succeed
+
+        :param ctx:         context command was invoked under: Context
+        :param resolution:  pending resolver request: Awaitable[ResolveResult]
+        :return:            resolved song info, None if resolution failed: Union[dict, list, None]
+        """
+        result = await resolution
+        if result.status in (ResolveStatus.FAILED, ResolveStatus.TIMED_OUT):
+            await ctx.channel.send(f"**Could not find a song for that!** ({result.status.value})", delete_after=20)
+        return result.song_info if result.ok else None
+
+    @staticmethod
+    def is_youtube_playlist(link: str) -> bool:
+        """
+            Checks if a link points at a YouTube playlist
+
+        :param link:    link or search keywords: str
+        :return:        link is a YouTube playlist: bool
+        """
+        return link.startswith(('https://www.youtube.com', 'https://youtube.com', 'https://music.youtube.com',
+                                'https://m.youtube.com', 'https://youtu.be')) and 'list=' in link
@@ -1,14 +1,13 @@
 # SongSearch.py
 
 from typing import Tuple, List
-from lib.helpers.Utils import ConfigUtil
+from lib.helpers.BotSettings import BotSettings
 from youtube_search import YoutubeSearch
 
 
 class SongSearch:
-    def __init__(self):
-        config = ConfigUtil().read_config('BOT_SETTINGS')
-        self.queue_display_length = config['queue_display_length']
+    def __init__(self, settings: BotSettings):
+        self.queue_display_length = settings.queue_display_length
 
     def search_yt(self, keywords: str) -> List[Tuple[str, str, str, str]]:
         """
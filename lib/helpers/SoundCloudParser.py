@@ -2,6 +2,7 @@
 
 from typing import List, Tuple, Union
 from lib.helpers.Utils import Util
+from lib.helpers.Song import Song
 from sclib import SoundcloudAPI, Playlist, Track
 
 
@@ -10,18 +11,18 @@ class SoundcloudParser:
         Soundcloud request parsing wrapper
     """
 
-    def __init__(self, author):
+    def __init__(self, author, utilities: Util):
         self.author = author
-        self.utilities = Util()
+        self.utilities = utilities
         self.api = SoundcloudAPI()  # never pass a Soundcloud client ID that did not come from this library
 
-    def parse_link(self, link: str) -> Tuple[Union[List[Tuple[str, str]], dict], bool]:
+    async def parse_link(self, link: str) -> Tuple[Union[List[Song], dict], bool]:
         """
             Parses soundcloud link
 
         :param link:    Soundcloud link: str
         :return:        song info tuple
-                            list[tuple("title artist", message author),...],
+                            list[Song("title artist", message author),...],
                         if link was a playlist
                             downloaded song info from youtube if link was a track
         """
@@ -30,12 +31,15 @@ class SoundcloudParser:
         song_info = None
         track_flag = False
         if type(response) == Playlist:
-            song_info = [(f'{self.utilities.scrub_song_title(track.title)} {track.artist}', self.author)
+            song_info = [Song(f'{self.utilities.scrub_song_title(track.title)} {track.artist}', self.author)
                          for track in response]
 
         elif type(response) == Track:
             track = f'{self.utilities.scrub_song_title(response.title)} {response.artist}'
-            song_info = Util().download_from_yt(track)
-            song_info = song_info[0] if type(song_info) == list else song_info
+            result = await self.utilities.resolver.resolve(track, self.author.guild.id)
+            if result.ok:
+                song_info = self.utilities.first_song_info(result.song_info)
+            else:
+                print(f"Failed to find Soundcloud track \"{track}\": {result.status.value} ({result.error})")
             track_flag = True
         return song_info, track_flag
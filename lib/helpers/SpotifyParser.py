@@ -6,6 +6,7 @@ import os
 from nextcord import Member
 from typing import Union, List, Tuple
 from lib.helpers.Utils import Util
+from lib.helpers.Song import Song
 from spotipy import SpotifyClientCredentials
 
 class SpotifyParser:
@@ -13,14 +14,14 @@ class SpotifyParser:
         Spotify request parsing wrapper
     """
 
-    def __init__(self, author: Member):
+    def __init__(self, author: Member, utilities: Util):
         self.author = author
-        self.utilities = Util()
+        self.utilities = utilities
         self.sp = spotipy.Spotify(
             client_credentials_manager=SpotifyClientCredentials(client_id=os.getenv('SPOTIFY_CID'),
                                                                 client_secret=os.getenv('SPOTIFY_SECRET')))
 
-    def parse_link(self, link: str):
+    async def parse_link(self, link: str):
         """
             Wrapper to pass link to correct parsing type
 
@@ -38,16 +39,16 @@ class SpotifyParser:
             song_info = self.parse_album(link)
 
         elif 'track' in link:
-            song_info = self.parse_track(link)
+            song_info = await self.parse_track(link)
             is_track = True
         return song_info, is_track
 
-    def parse_playlist(self, link: str) -> List[Tuple[str, Member]]:
+    def parse_playlist(self, link: str) -> List[Song]:
         """
             Parses spotify playlist
 
         :param link:    Spotify link
-        :return:        list[tuple(title, message author),...]
+        :return:        list[Song("title artist", message author),...]
         """
         offset = 0
         result = []
@@ -63,16 +64,16 @@ class SpotifyParser:
                         artist = x['track']['album']['artists'][0]['name']
                     else:
                         artist = 'song'
-                    result.append((f'{title} {artist}', self.author))
+                    result.append(Song(f'{title} {artist}', self.author))
             offset = offset + len(response['items'])
         return result
 
-    def parse_album(self, link: str) -> List[Tuple[str, Member]]:
+    def parse_album(self, link: str) -> List[Song]:
         """
             Parses spotify album
 
         :param link:    Spotify link
-        :return:        list[tuple(title, message author),...]
+        :return:        list[Song("title artist", message author),...]
         """
         response = self.sp.album(link)
         result = []
@@ -83,10 +84,10 @@ class SpotifyParser:
                     artist = x['artists'][0]['name']
                 else:
                     artist = 'song'
-                result.append((f'{title} {artist}', self.author))
+                result.append(Song(f'{title} {artist}', self.author))
         return result
 
-    def parse_track(self, link: str) -> dict:
+    async def parse_track(self, link: str) -> dict:
         """
             Parses spotify track
 
@@ -100,23 +101,26 @@ class SpotifyParser:
                 artist = response['album']['artists'][0]['name']
             else:
                 artist = 'song'
-            song_info = Util().download_from_yt(f'{title} {artist}')
-            return song_info[0] if type(song_info) == list else song_info
+            result = await self.utilities.resolver.resolve(f'{title} {artist}', self.author.guild.id)
+            if not result.ok:
+                print(f"Failed to find Spotify track \"{title} {artist}\": {result.status.value} ({result.error})")
+                return None
+            return self.utilities.first_song_info(result.song_info)
 
     def artist_search(self, query: str) -> List[Tuple[str, str]]:
         response = self.sp.search(q=query, type='artist', limit=5)
         results = [(artist['name'], artist['uri'].split(':')[2]) for artist in response['artists']['items']]
         return results
 
-    def get_artist_top_tracks(self, artist_uri: str) -> List[Tuple[str, Member]]:
+    def get_artist_top_tracks(self, artist_uri: str) -> List[Song]:
         response = self.sp.artist_top_tracks(artist_uri, country='US')
-        return [(f"{self.utilities.scrub_song_title(track['name'])} {track['artists'][0]['name']}",
+        return [Song(f"{self.utilities.scrub_song_title(track['name'])} {track['artists'][0]['name']}",
                  self.author)
                 for track in response['tracks']]
 
-    def get_artist_all_tracks(self, artist_uri: str) -> List[Tuple[str, Member]]:
+    def get_artist_all_tracks(self, artist_uri: str) -> List[Song]:
         response = self.sp.artist_albums(artist_uri, album_type='album,single', limit=50, country='US')
-        return [(f"{self.utilities.scrub_song_title(album_track['name'])} {album_track['artists'][0]['name']}",
+        return [Song(f"{self.utilities.scrub_song_title(album_track['name'])} {album_track['artists'][0]['name']}",
                  self.author)
                 for album in response['items']
                 for album_track in self.sp.album_tracks(album['uri'].split(':')[2], limit=50)['items']]
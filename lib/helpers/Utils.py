@@ -1,104 +1,652 @@
 # Utils.py
 
+import copy
+import functools
 import math
-import yt_dlp as youtube_dl
+import os
+import time
 import asyncio
-import random
+import threading
 
-from rebel import Database, PgsqlDriver
-from json import load
-from typing import Any, Union, List, Iterable
-from nextcord import Client, Message, Member
+from json import load, dump
+from typing import Any, Union, List, Iterable, Optional, Callable
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
+from nextcord import Client, Message
 from traceback import format_exc
+from lib.helpers.SettingsStore import SettingsStore, create_store, backend_options
+from lib.helpers.BotSettings import BotSettings
+from lib.helpers.PrefixRouter import PrefixRouter
+from lib.helpers.Resolver import Resolver, ResolveStatus
+from lib.helpers.GuildQueue import GuildQueue
+from lib.helpers.DBMetrics import db_metrics, current_call_site
 
 
 class ConfigUtil:
     """
         Config Utility functions for music bot
+
+        Settings read from the DB are cached process-wide, the cache is invalidated on writes and expires after
+        the 'ttl' (seconds) set in the 'SettingsCache' section of app-settings.json
+
+        Guild settings changed through set_guild_settings are authoritative in memory and written behind: changes
+        are coalesced per guild and flushed to the DB in one transaction by flush_guild_settings
+
+        The last-known-good settings are kept in a local snapshot file ('snapshot_path' in 'SettingsCache'),
+        loaded before the bot starts and reconciled with the DB in the background. Guild reads that fail while the
+        DB is unreachable fall back to stale cache entries, then the snapshot, then the defaults.
     """
 
+    DEFAULT_CACHE_TTL = 300
+    # Delay before retrying a failed reconcile, doubled per failure up to the max (seconds)
+    RECONCILE_BACKOFF = 5
+    RECONCILE_MAX_BACKOFF = 300
+
+    # Shared between all ConfigUtil instances: {field: (time cached, settings)}
+    _cache = {}
+    # Per-guild point lookups: {guild_id: (time cached, settings or None if guild has no row)}
+    _guild_cache = {}
+    # Guild settings changed in memory but not yet written: {guild_id: settings or None to delete}
+    _dirty = {}
+    # Writes per guild: {guild_id: int}, a DB read only caches its row if no write happened while it ran
+    _guild_versions = {}
+    _app_settings = None
+    _migrated = False
+    # Guild reads/writes on several DB executor threads may try the migration at once
+    _migrate_lock = threading.Lock()
+    # Typed bot settings, loaded once per process
+    _bot_settings = None
+    # Last-known-good settings mirrored to the snapshot file: {'BOT_SETTINGS': dict, 'SERVER_SETTINGS': dict}
+    _snapshot = None
+    # Answers the bot's command_prefix callback from memory
+    prefix_router = PrefixRouter()
+    # Settings backend and its connection pool, lives as long as the bot
+    _store = None
+    # Dedicated threads for DB I/O so queries never run on the event loop
+    _executor = None
+    # Guild reads are failing, the outage is only logged once until a read succeeds again
+    _store_failing = False
+    # Reconcile state: succeeded once, in progress, monotonic time of the next retry and current retry delay
+    _reconciled = False
+    _reconciling = False
+    _next_reconcile = 0.0
+    _reconcile_backoff = RECONCILE_BACKOFF
+
     def __init__(self):
         self.invalid_config_message = """Config file is invalid
         likely due to a missing starting guild id or an invalid invite link"""
 
     @staticmethod
-    def db_connect():
-        driver = None
-        with open('app-settings.json') as f:
-            json_data = load(f)
-            if json_data.get('DBConnection'):
-                driver = PgsqlDriver(
-                    host=json_data['DBConnection']['host'],
-                    port=json_data['DBConnection']['port'],
-                    database=json_data['DBConnection']['database'],
-                    user=json_data['DBConnection']['user'],
-                    password=json_data['DBConnection']['password']
-                )
-        if driver is None:
-            print("Failed to connect to DB")
-        return Database(driver)
+    def app_settings() -> dict:
+        """
+            Reads app-settings.json, only read once per process
+
+        :return:    app settings: dict
+        """
+        if ConfigUtil._app_settings is None:
+            try:
+                with open('app-settings.json') as f:
+                    ConfigUtil._app_settings = load(f)
+            except (OSError, ValueError):
+                print('Failed to read app-settings.json')
+                ConfigUtil._app_settings = {}
+        return ConfigUtil._app_settings
+
+    @staticmethod
+    def get_store() -> Optional[SettingsStore]:
+        """
+            Gets the process-wide settings store selected in app-settings.json, created on first use
+
+        :return:    settings store, None if the backend is not configured: SettingsStore
+        """
+        if ConfigUtil._store is None:
+            # A new SQLite file starts out with the last-known-good settings
+            ConfigUtil._store = create_store(ConfigUtil.app_settings(), ConfigUtil._snapshot)
+        return ConfigUtil._store
+
+    @staticmethod
+    def close_store() -> None:
+        """
+            Closes all pooled DB connections, call on bot shutdown
+
+        :return:    None
+        """
+        if ConfigUtil._store is not None:
+            ConfigUtil._store.close()
+            ConfigUtil._store = None
+
+    @staticmethod
+    def get_executor() -> ThreadPoolExecutor:
+        """
+            Gets the executor DB queries are run on from async code, sized to match the connection pool
+
+        :return:    DB executor: ThreadPoolExecutor
+        """
+        if ConfigUtil._executor is None:
+            size = backend_options(ConfigUtil.app_settings()).get('pool_size', 4)
+            ConfigUtil._executor = ThreadPoolExecutor(max_workers=size, thread_name_prefix='settings-db')
+        return ConfigUtil._executor
+
+    @staticmethod
+    def shutdown() -> None:
+        """
+            Stops the DB executor and closes the connection pool, call on bot shutdown
+
+        :return:    None
+        """
+        if ConfigUtil._executor is not None:
+            ConfigUtil._executor.shutdown(wait=True)
+            ConfigUtil._executor = None
+        # Event loop is gone, write any pending guild changes directly
+        batch, ConfigUtil._dirty = ConfigUtil._dirty, {}
+        if batch and not ConfigUtil._write_guilds(batch):
+            print(f"Lost settings changes for {len(batch)} guilds on shutdown")
+        ConfigUtil.close_store()
+
+    @staticmethod
+    def flush_interval() -> float:
+        """
+            Reads the write-behind flush interval from app-settings.json
+
+        :return:    flush interval in seconds: float
+        """
+        return ConfigUtil.app_settings().get('SettingsCache', {}).get('flush_interval_ms', 500) / 1000
+
+    @staticmethod
+    async def run_db(func: Callable, *args) -> Any:
+        """
+            Runs a blocking settings function on the DB executor
+
+        :param func:    blocking function: Callable
+        :param args:    arguments for func
+        :return:        result of func: Any
+        """
+        loop = asyncio.get_running_loop()
+        # Carry the call site into the executor thread, its stack does not include the caller
+        context = copy_context()
+        context.run(current_call_site.set, db_metrics.call_site())
+        return await loop.run_in_executor(ConfigUtil.get_executor(), functools.partial(context.run, func, *args))
+
+    @staticmethod
+    def cache_ttl() -> float:
+        """
+            Reads the settings cache TTL from app-settings.json
+
+        :return:    cache TTL in seconds: float
+        """
+        return float(ConfigUtil.app_settings().get('SettingsCache', {}).get('ttl', ConfigUtil.DEFAULT_CACHE_TTL))
+
+    @staticmethod
+    def invalidate_cache(field: str = None) -> None:
+        """
+            Drops cached settings so the next read goes to the DB
+
+        :param field:   'BOT_SETTINGS' | 'SERVER_SETTINGS', all fields if None: str
+        :return:        None
+        """
+        if field is None:
+            ConfigUtil._cache.clear()
+        else:
+            ConfigUtil._cache.pop(field, None)
+        if field in (None, 'SERVER_SETTINGS'):
+            ConfigUtil._guild_cache.clear()
+
+    @staticmethod
+    def _cached_config(field: str) -> dict:
+        """
+            Returns the shared cached settings for a field, refreshing from the DB if missing or expired
+                NOTE: Returned dict is shared, callers must not modify it
+
+        :param field:   'BOT_SETTINGS' | 'SERVER_SETTINGS': str
+        :return:        settings dict
+        """
+        cached = ConfigUtil._cache.get(field)
+        if cached and time.monotonic() - cached[0] < ConfigUtil.cache_ttl():
+            return cached[1]
+
+        settings = ConfigUtil._query_config(field)
+        if settings:
+            ConfigUtil._cache[field] = (time.monotonic(), settings)
+        return settings
+
+    @staticmethod
+    def _is_cached(field: str) -> bool:
+        """
+            Checks if a field can be served from the settings cache without I/O
+
+        :param field:   'BOT_SETTINGS' | 'SERVER_SETTINGS': str
+        :return:        if cache entry is fresh: bool
+        """
+        cached = ConfigUtil._cache.get(field)
+        return bool(cached) and time.monotonic() - cached[0] < ConfigUtil.cache_ttl()
+
+    @staticmethod
+    def _guild_settings(guild_id: Union[int, str]) -> dict:
+        """
+            Blocking lookup of a single guild's settings, defaults are returned for unknown guilds
+
+        :param guild_id:    Discord Guild ID: Union[int, str]
+        :return:            {"prefix": str, "loop": bool}: dict
+        """
+        guild_id = str(guild_id)
+        cached = ConfigUtil._guild_cache.get(guild_id)
+        if guild_id in ConfigUtil._dirty:
+            # Pending changes are newer than anything in the DB
+            settings = ConfigUtil._dirty[guild_id]
+        elif cached and time.monotonic() - cached[0] < ConfigUtil.cache_ttl():
+            settings = cached[1]
+        elif ConfigUtil._is_cached('SERVER_SETTINGS'):
+            # Full table is already in memory, no need for a round trip
+            settings = ConfigUtil._cache['SERVER_SETTINGS'][1].get(guild_id)
+        else:
+            version = ConfigUtil._guild_versions.get(guild_id, 0)
+            try:
+                settings = ConfigUtil._query_guild(guild_id)
+            except Exception as e:
+                ConfigUtil._store_failed(e)
+                return ConfigUtil._last_known_guild(guild_id)
+            ConfigUtil._store_failing = False
+            if guild_id in ConfigUtil._dirty:
+                # Changed while the row was read, the row is already outdated
+                settings = ConfigUtil._dirty[guild_id]
+            elif ConfigUtil._guild_versions.get(guild_id, 0) != version:
+                # Written (and possibly flushed) while the row was read, the write updated the cache
+                written = ConfigUtil._guild_cache.get(guild_id)
+                settings = written[1] if written else settings
+            else:
+                ConfigUtil._guild_cache[guild_id] = (time.monotonic(), settings)
+
+        if settings is None:
+            try:
+                default_prefix = ConfigUtil._cached_config('BOT_SETTINGS')['default_prefix']
+            except Exception as e:
+                ConfigUtil._store_failed(e)
+                default_prefix = ConfigUtil._last_known_default_prefix()
+            return {"prefix": default_prefix, "loop": False}
+        return dict(settings)
+
+    @staticmethod
+    def _last_known_guild(guild_id: str) -> dict:
+        """
+            Last known settings of a guild without any I/O, used while the DB can't be read
+                Stale cache entries are tried first, then the snapshot, then the defaults
+
+        :param guild_id:    Discord Guild ID: str
+        :return:            {"prefix": str, "loop": bool}: dict
+        """
+        cached = ConfigUtil._guild_cache.get(guild_id)
+        server_settings = ConfigUtil._cache.get('SERVER_SETTINGS')
+        snapshot = (ConfigUtil._snapshot or {}).get('SERVER_SETTINGS') or {}
+        if cached:
+            settings = cached[1]
+        elif server_settings and guild_id in server_settings[1]:
+            settings = server_settings[1][guild_id]
+        else:
+            settings = snapshot.get(guild_id)
+
+        if settings is None:
+            return {"prefix": ConfigUtil._last_known_default_prefix(), "loop": False}
+        return dict(settings)
+
+    @staticmethod
+    def _last_known_default_prefix() -> str:
+        """
+            Last known default prefix without any I/O
+
+        :return:    default prefix: str
+        """
+        bot_settings = ConfigUtil._cache.get('BOT_SETTINGS')
+        snapshot = (ConfigUtil._snapshot or {}).get('BOT_SETTINGS') or {}
+        return (bot_settings[1] if bot_settings else {}).get('default_prefix') \
+            or snapshot.get('default_prefix') or ConfigUtil.prefix_router.default_prefix
+
+    @staticmethod
+    def _store_failed(error: Exception) -> None:
+        """
+            Logs a failed guild settings read, once per outage
+
+        :param error:   error raised by the settings store: Exception
+        :return:        None
+        """
+        if not ConfigUtil._store_failing:
+            ConfigUtil._store_failing = True
+            print(f'Settings store unreachable, using last known guild settings ({error})')
+
+    @staticmethod
+    async def get_guild_settings(guild_id: Union[int, str]) -> dict:
+        """
+            Non-blocking read of a guild's settings
+                Cache hits are answered immediately, misses query the DB on the DB executor
+
+        :param guild_id:    Discord Guild ID: Union[int, str]
+        :return:            {"prefix": str, "loop": bool}: dict
+        """
+        cached = ConfigUtil._guild_cache.get(str(guild_id))
+        guild_cached = str(guild_id) in ConfigUtil._dirty \
+            or (cached and time.monotonic() - cached[0] < ConfigUtil.cache_ttl()) \
+            or ConfigUtil._is_cached('SERVER_SETTINGS')
+        if guild_cached and ConfigUtil._is_cached('BOT_SETTINGS'):
+            return ConfigUtil._guild_settings(guild_id)
+        try:
+            return await ConfigUtil.run_db(ConfigUtil._guild_settings, guild_id)
+        except Exception as e:
+            # DB executor itself failed (e.g. shut down)
+            ConfigUtil._store_failed(e)
+            return ConfigUtil._last_known_guild(str(guild_id))
+
+    @staticmethod
+    async def set_guild_settings(guild_id: Union[int, str], settings: dict) -> bool:
+        """
+            Updates a guild's settings in memory, the DB write happens on the next flush
+                Writing the value the guild already has is a no-op
+
+        :param guild_id:    Discord Guild ID: Union[int, str]
+        :param settings:    {"prefix": str, "loop": bool}: dict
+        :return:            success: bool
+        """
+        settings = {"prefix": settings.get('prefix'), "loop": settings.get('loop')}
+        guild_id = str(guild_id)
+        if guild_id not in ConfigUtil._dirty:
+            cached = ConfigUtil._guild_cache.get(guild_id)
+            if cached and cached[1] == settings:
+                return True
+        ConfigUtil._dirty[guild_id] = settings
+        ConfigUtil._update_cached_guild(guild_id, settings)
+        return True
+
+    @staticmethod
+    async def delete_guild_settings(guild_id: Union[int, str]) -> bool:
+        """
+            Removes a guild's settings in memory, the DB delete happens on the next flush
+
+        :param guild_id:    Discord Guild ID: Union[int, str]
+        :return:            success: bool
+        """
+        ConfigUtil._dirty[str(guild_id)] = None
+        ConfigUtil._update_cached_guild(str(guild_id), None)
+        return True
+
+    @staticmethod
+    async def flush_guild_settings() -> bool:
+        """
+            Writes all pending guild settings changes to the DB in one transaction
+                Changes are kept for the next flush if the write fails
+
+        :return:    success: bool
+        """
+        if not ConfigUtil._dirty:
+            return True
+        batch, ConfigUtil._dirty = ConfigUtil._dirty, {}
+        if await ConfigUtil.run_db(ConfigUtil._write_guilds, batch):
+            if ConfigUtil._snapshot is not None:
+                servers = dict(ConfigUtil._snapshot['SERVER_SETTINGS'])
+                for guild_id, settings in batch.items():
+                    if settings is None:
+                        servers.pop(guild_id, None)
+                    else:
+                        servers[guild_id] = settings
+                ConfigUtil._snapshot = {'BOT_SETTINGS': ConfigUtil._snapshot['BOT_SETTINGS'],
+                                        'SERVER_SETTINGS': servers}
+                await ConfigUtil.run_db(ConfigUtil._write_snapshot, ConfigUtil._snapshot)
+            return True
+        # Re-queue failed changes unless the guild changed again in the meantime
+        for guild_id, settings in batch.items():
+            ConfigUtil._dirty.setdefault(guild_id, settings)
+        return False
+
+    @staticmethod
+    @db_metrics.instrument('_write_guilds')
+    def _write_guilds(batch: dict) -> bool:
+        """
+            Blocking upsert/delete of several guilds' settings in a single transaction
+
+        :param batch:   {guild_id: settings or None to delete}: dict
+        :return:        success: bool
+        """
+        store = ConfigUtil.get_store()
+        if store is None:
+            return False
+
+        try:
+            # Upserts need the unique guild_id index
+            ConfigUtil.ensure_migrated()
+            store.write_guilds(batch)
+        except Exception:
+            print('ConfigUtil._write_guilds | {}'.format(format_exc()))
+            return False
+        return True
+
+    @staticmethod
+    def snapshot_path() -> str:
+        """
+            Reads the settings snapshot location from app-settings.json
+
+        :return:    snapshot file path: str
+        """
+        return ConfigUtil.app_settings().get('SettingsCache', {}).get('snapshot_path', 'settings-snapshot.json')
+
+    @staticmethod
+    def load_snapshot() -> bool:
+        """
+            Seeds the settings cache from the local snapshot file so start-up does not wait on the DB
+
+        :return:    if a usable snapshot was loaded: bool
+        """
+        try:
+            with open(ConfigUtil.snapshot_path()) as f:
+                snapshot = load(f)
+            bot_settings, server_settings = snapshot['BOT_SETTINGS'], snapshot['SERVER_SETTINGS']
+        except FileNotFoundError:
+            return False
+        except (OSError, ValueError, KeyError, TypeError):
+            print('Settings snapshot is unreadable, waiting on DB')
+            return False
+        if not bot_settings:
+            return False
+
+        now = time.monotonic()
+        ConfigUtil._cache['BOT_SETTINGS'] = (now, bot_settings)
+        ConfigUtil._cache['SERVER_SETTINGS'] = (now, server_settings)
+        ConfigUtil.prefix_router.load(server_settings, bot_settings.get('default_prefix'))
+        ConfigUtil._snapshot = snapshot
+        return True
+
+    @staticmethod
+    def _write_snapshot(snapshot: dict) -> None:
+        """
+            Blocking write of the settings snapshot file, replaced atomically so a crash never leaves it half written
+
+        :param snapshot:    {'BOT_SETTINGS': dict, 'SERVER_SETTINGS': dict}: dict
+        :return:            None
+        """
+        path = ConfigUtil.snapshot_path()
+        try:
+            with open(f'{path}.tmp', 'w') as f:
+                dump(snapshot, f, default=str)
+            os.replace(f'{path}.tmp', path)
+        except OSError:
+            print('ConfigUtil._write_snapshot | {}'.format(format_exc()))
+
+    @staticmethod
+    async def reconcile_settings() -> bool:
+        """
+            Refreshes the settings cache and snapshot from the DB
+                Guild changes that are still waiting to be flushed win over DB values
+                Failures are retried with backoff by retry_reconcile
+
+        :return:    success: bool
+        """
+        if ConfigUtil._reconciling:
+            return False
+        ConfigUtil._reconciling = True
+        try:
+            reconciled = await ConfigUtil._reconcile_settings()
+        finally:
+            ConfigUtil._reconciling = False
+        if reconciled:
+            ConfigUtil._reconciled = True
+            ConfigUtil._reconcile_backoff = ConfigUtil.RECONCILE_BACKOFF
+        else:
+            ConfigUtil._next_reconcile = time.monotonic() + ConfigUtil._reconcile_backoff
+            ConfigUtil._reconcile_backoff = min(ConfigUtil._reconcile_backoff * 2, ConfigUtil.RECONCILE_MAX_BACKOFF)
+        return reconciled
+
+    @staticmethod
+    async def retry_reconcile() -> None:
+        """
+            Retries a failed start-up reconcile once its backoff has passed, call periodically
+
+        :return:    None
+        """
+        if ConfigUtil._reconciled or ConfigUtil._reconciling or time.monotonic() < ConfigUtil._next_reconcile:
+            return
+        if await ConfigUtil.reconcile_settings():
+            print('Settings reconciled with the DB')
+
+    @staticmethod
+    async def _reconcile_settings() -> bool:
+        """
+            One reconcile attempt, see reconcile_settings
+
+        :return:    success: bool
+        """
+        try:
+            await ConfigUtil.run_db(ConfigUtil.ensure_migrated)
+            bot_settings = await ConfigUtil.run_db(ConfigUtil._query_config, 'BOT_SETTINGS')
+            server_settings = await ConfigUtil.run_db(ConfigUtil._query_config, 'SERVER_SETTINGS')
+        except Exception:
+            print('ConfigUtil.reconcile_settings | {}'.format(format_exc()))
+            return False
+        if not bot_settings:
+            print('Failed to read settings from DB, keeping snapshot')
+            return False
+
+        for guild_id, settings in ConfigUtil._dirty.items():
+            if settings is None:
+                server_settings.pop(guild_id, None)
+            else:
+                server_settings[guild_id] = dict(settings)
+
+        now = time.monotonic()
+        ConfigUtil._cache['BOT_SETTINGS'] = (now, bot_settings)
+        ConfigUtil._cache['SERVER_SETTINGS'] = (now, server_settings)
+        ConfigUtil.prefix_router.load(server_settings, bot_settings.get('default_prefix'))
+        ConfigUtil._guild_cache.clear()
+        if ConfigUtil._bot_settings is not None and ConfigUtil._bot_settings != BotSettings.from_dict(bot_settings):
+            print('Bot settings changed in DB since last snapshot, restart to apply')
+
+        ConfigUtil._snapshot = {'BOT_SETTINGS': bot_settings, 'SERVER_SETTINGS': server_settings}
+        await ConfigUtil.run_db(ConfigUtil._write_snapshot, ConfigUtil._snapshot)
+        return True
+
+    @staticmethod
+    def get_bot_settings() -> BotSettings:
+        """
+            Gets the shared bot settings, queried from the DB only the first time
+
+        :return:    bot settings: BotSettings
+        """
+        if ConfigUtil._bot_settings is None:
+            ConfigUtil._bot_settings = BotSettings.from_dict(ConfigUtil._cached_config('BOT_SETTINGS'))
+        return ConfigUtil._bot_settings
 
     def get_prefix(self, client: Client, message: Message) -> str:
         """
             Get prefixes from config.ini
+                O(1) in-memory lookup, unknown guilds and DMs get the default prefix
 
         :param client:      nextcord.Client object, automatically passed: Client
         :param message:     nextcord.Message object: Message
         :return:            guild prefix str from config: str
         """
-        server_config = self.read_config('SERVER_SETTINGS')
-        # in DM messages force default prefix
-        if message is None or not message.guild:
-            return self.read_config('BOT_SETTINGS')['default_prefix']
-        return server_config[str(message.guild.id)]['prefix']
+        return ConfigUtil.prefix_router.get_prefix(client, message)
 
     @staticmethod
+    @db_metrics.instrument('read_config', field_arg=True)
     def read_config(field: str) -> dict:
         """
             Collects DB information based on "field" - outdated concept from config.ini
+                Served from the settings cache when possible, returns a copy that is safe to modify
 
         :param field:   config.ini field to read and return values from (valid are 'BOT_SETTINGS' & 'SERVER_SETTINGS'
         :return:        Tuple with config values
         """
-        db = ConfigUtil.db_connect()
-        if db is None:
+        settings = ConfigUtil._cached_config(field)
+        if field == 'SERVER_SETTINGS':
+            return {guild_id: dict(values) for guild_id, values in settings.items()}
+        return copy.deepcopy(settings) if settings else {}
+
+    @staticmethod
+    @db_metrics.instrument('_query_config', field_arg=True)
+    def _query_config(field: str) -> dict:
+        """
+            Queries the DB for settings based on "field"
+
+        :param field:   'BOT_SETTINGS' | 'SERVER_SETTINGS': str
+        :return:        settings dict
+        """
+        store = ConfigUtil.get_store()
+        if store is None:
             return {}
 
         if field == 'BOT_SETTINGS':
-            return db.query_one("""
-                SELECT 
-                    invite_link,
-                    doom_playlist,
-                    ydl_opts,
-                    ffmpeg_opts,
-                    embed_theme,
-                    queue_display_length,
-                    default_prefix,
-                    view_timeout,
-                    dj_role_name,
-                    broken,
-                    debug_mode
-                FROM public."primary-config"
-                WHERE active = true
-            """)
+            return store.query_bot_settings() or {}
         elif field == 'SERVER_SETTINGS':
-            q_data = db.query("""
-                SELECT
-                    guild_id,
-                    prefix,
-                    loop
-                FROM public."server-settings"
-            """)
-            return {i['guild_id']: {
-                "prefix": i['prefix'],
-                "loop": i['loop']
-            } for i in q_data}
+            return store.query_server_settings()
         else:
             print("invalid table queried!")
 
         return {}
 
     @staticmethod
+    @db_metrics.instrument('_query_guild')
+    def _query_guild(guild_id: str) -> Optional[dict]:
+        """
+            Queries the DB for a single guild's settings
+
+        :param guild_id:    Discord Guild ID: str
+        :return:            {"prefix": str, "loop": bool}, None if the guild has no settings: dict
+        """
+        store = ConfigUtil.get_store()
+        if store is None:
+            return None
+        # Duplicate rows of the guild are collapsed first
+        ConfigUtil.ensure_migrated()
+        return store.query_guild(guild_id)
+
+    @staticmethod
+    def ensure_migrated() -> None:
+        """
+            Runs the one-time migration before the first guild read or write that depends on it
+                Tried again on every call until it succeeds, e.g. if the DB was unreachable at start-up
+
+        :return:    None
+        """
+        if ConfigUtil._migrated:
+            return
+        with ConfigUtil._migrate_lock:
+            ConfigUtil.migrate_server_settings()
+
+    @staticmethod
+    @db_metrics.instrument('migrate_server_settings')
+    def migrate_server_settings() -> None:
+        """
+            One-time migration of "server-settings" to one row per guild, see SettingsStore.migrate
+
+        :return:    None
+        """
+        if ConfigUtil._migrated:
+            return
+        store = ConfigUtil.get_store()
+        if store is None:
+            return
+
+        store.migrate()
+        ConfigUtil._migrated = True
+        ConfigUtil.invalidate_cache('SERVER_SETTINGS')
+
+    @staticmethod
+    @db_metrics.instrument('write_config')
     def write_config(mode: str, field: str, key: str, value: Any = None) -> bool:
         """
             Writes/Deletes key-value pair to config.ini
@@ -109,26 +657,47 @@ class ConfigUtil:
         :param value:   Value for key in config: Any
         :return:        success: bool
         """
-        db = ConfigUtil.db_connect()
-        if db is None:
+        store = ConfigUtil.get_store()
+        if store is None:
             return False
 
         if mode == 'w':
-            db.execute("""
-                INSERT INTO public."server-settings"(
-                    guild_id, prefix, loop)
-                VALUES (?, ?, ?);
-            """, key, value.get('prefix'), value.get('loop'))
+            settings = {"prefix": value.get('prefix'), "loop": value.get('loop')}
         elif mode == 'd':
-            db.execute("""
-                DELETE FROM public."server-settings"
-                    WHERE guild_id = ?;
-            """, key)
+            settings = None
         else:
             print('invalid config write mode')
             return False
+        ConfigUtil.ensure_migrated()
+        store.write_guilds({key: settings})
+        ConfigUtil._update_cached_guild(key, settings)
         return True
 
+    @staticmethod
+    def _update_cached_guild(guild_id: str, settings: Optional[dict]) -> None:
+        """
+            Writes a guild's new settings through to the caches
+
+        :param guild_id:    Discord Guild ID: str
+        :param settings:    {"prefix": str, "loop": bool}, None if the guild was removed: dict
+        :return:            None
+        """
+        ConfigUtil._guild_cache[guild_id] = (time.monotonic(), settings)
+        ConfigUtil._guild_versions[guild_id] = ConfigUtil._guild_versions.get(guild_id, 0) + 1
+        if settings is None:
+            ConfigUtil.prefix_router.remove_guild(guild_id)
+        else:
+            ConfigUtil.prefix_router.set_prefix(guild_id, settings['prefix'])
+        cached = ConfigUtil._cache.get('SERVER_SETTINGS')
+        if cached:
+            # Copy on write, the shared dict may be iterated from the DB executor
+            server_settings = dict(cached[1])
+            if settings is None:
+                server_settings.pop(guild_id, None)
+            else:
+                server_settings[guild_id] = dict(settings)
+            ConfigUtil._cache['SERVER_SETTINGS'] = (cached[0], server_settings)
+
     def validate_config(self) -> bool:
         """
             Checks for a valid default guild id and invite link, set in config.ini
@@ -162,10 +731,10 @@ class Util:
         Utility functions for music bot
     """
 
-    def __init__(self):
-        config_obj = ConfigUtil()
-        self.config = config_obj.read_config('BOT_SETTINGS')
-        self.ydl_opts = self.config['ydl_opts']
+    def __init__(self, settings: BotSettings, resolver: Resolver):
+        self.config = settings
+        self.ydl_opts = settings.ydl_opts
+        self.resolver = resolver
 
     @staticmethod
     def tuple_to_string(tup: tuple) -> str:
@@ -180,105 +749,51 @@ class Util:
         return temp.strip()
 
     @staticmethod
-    def song_info_to_tuple(song_info: dict, author: Member) -> tuple:
+    def first_song_info(song_info: Union[dict, List[dict]]) -> dict:
         """
-            Extract info from song_info into song tuple
+            Gets the song info of a resolved query
+                Search keywords resolve to a list of results, links (e.g. lazily added playlist entries) to a dict
 
-        :param song_info:   dict from youtube_dl download: dict
-        :param author:      ctx.message.author: Member
-        :return:            (title: str,
-                                url: str,
-                                web_page: str,
-                                ctx.message.author: Member,
-                                duration: int,
-                                thumbnail: str): tuple
+        :param song_info:   song info dict or list of song info dicts from youtube_dl: Union[dict, List[dict]]
+        :return:            song info dict: dict
         """
-        title = song_info['title']
-        # url = song_info['formats'][0]['url']
-        url = song_info['url']
-        web_page = song_info['webpage_url']
-        duration = song_info['duration']
-        thumbnail = song_info["thumbnails"][-1]['url']
-        # print(title, url, web_page, author, duration, thumbnail)
-        return title, url, web_page, author, duration, thumbnail
+        return song_info[0] if isinstance(song_info, list) else song_info
 
-    def download_from_yt(self, link: str) -> Union[dict, List[dict]]:
-        """
-            Extracts info from yt link, adds song to server queue, plays song from queue.
-
-        :param link:    link str
-        :return:        song info dict
-                        list of song info dicts if link is a playlist
-        """
-        # Call Youtube_DL to fetch song info
-        song_info = None
-        with youtube_dl.YoutubeDL(self.ydl_opts) as ydl:
-            while not song_info:
-                song_info = ydl.extract_info(link, download=False)
-                # Detect if link is a playlist
-                try:
-                    if song_info and song_info['_type'] == 'playlist':
-                        # If link is a playlist set song_info to a list of songs
-                        song_info = song_info['entries']
-                except KeyError:
-                    if self.config['debug_mode']:
-                        print('Util.download_from_yt | {}'.format(format_exc()))
-        # print(song_info)  # Debug call to see youtube_dl output
-        return song_info
-
-    async def repopulate_queue(self, server_queue: list) -> None:
-        """
-            Iterates through server song queue and repopulates non-youtube sourced songs with youtube dl song info
-                NOTE: In-place modification
-
-        :param server_queue:   Server Song Queue: list
-        :return:               None
-        """
-
-        loop = asyncio.get_event_loop()
-        for i in range(len(server_queue)):
-            try:
-                if len(server_queue[i]) == 2:
-                    old_song = server_queue[i]
-                    song_info = await loop.run_in_executor(None, lambda: self.download_from_yt(old_song[0]))
-                    new_song = self.song_info_to_tuple(song_info[0], old_song[1])
-
-                    song_index = server_queue.index(old_song)
-                    server_queue[song_index] = new_song
-            except IndexError or ValueError:
-                if self.config['debug_mode']:
-                    print('Util.repopulate_queue | {}'.format(format_exc()))
-
-    def get_first_in_queue(self, queue: list) -> str:
+    async def get_first_in_queue(self, queue: GuildQueue) -> Optional[str]:
         """
             Gets first song in the queue, download info if necessary
+                Songs that fail to resolve are removed, the next song is tried instead. A playback url that expires
+                within the resolver's refresh margin (restored or resolved long ago) is resolved again first.
 
-        :param queue:   Server song queue: list
-        :return:        playback url of first song in queue: str
+        :param queue:   Server song queue: GuildQueue
+        :return:        playback url of first song in queue, None if the queue ran out or resolution was cancelled: str
         """
-        if len(queue[0]) == 2:
-            song_title, message_author = queue[0]
-            yt_dl = self.download_from_yt(song_title)
-            queue[0] = self.song_info_to_tuple(yt_dl[0], message_author)
-        return queue[0][1]
+        if queue and queue[0].resolved \
+                and not queue[0].is_fresh(time.time() + self.resolver.cache.refresh_margin):
+            queue.expire(queue[0])
+        while queue and not queue[0].resolved:
+            song = queue[0]
+            result = await self.resolver.resolve(song.query, song.author.guild.id, song=song)
+            if result.status is ResolveStatus.CANCELLED:
+                return None
+            if result.ok:
+                queue.resolve(song, self.first_song_info(result.song_info))
+            else:
+                print(f"Skipping \"{song.display_title}\": {result.status.value} ({result.error})")
+                queue.remove(song)
+        return queue[0].url if queue else None
 
     @staticmethod
-    def calculate_duration(queue: list) -> str:
+    def calculate_duration(queue: GuildQueue) -> str:
         """
-            Calculate duration of Song Queue
+            Formats duration of Song Queue from its running totals
+                Unknown durations are estimated, the result is marked approximate then
 
-        :param queue:   Server Song Queue: list
-        :return:        "???" or Queue Duration: str
+        :param queue:   Server Song Queue: GuildQueue
+        :return:        Queue Duration: str
         """
-        duration = 0
-        flag = False
-        for song in queue:
-            if not len(song) == 2:
-                duration += song[4]
-            else:
-                # 3min = 180, 5min = 300
-                duration += random.randint(180, 260)
-                flag = True
+        duration = queue.estimated_duration
+        flag = queue.unknown_durations > 0
 
         if duration < 3660:  # 1 hour
             duration = f"{math.floor(duration / 60)}min {str(math.floor(duration % 60)).rjust(2, '0')}sec"
@@ -5,8 +5,11 @@ import nextcord
 from typing import List, Any
 from nextcord import Interaction, ui
 from nextcord.ext.commands import Bot, Context
-from lib.helpers.Utils import ConfigUtil
 from lib.helpers.Embeds import Embeds
+from lib.helpers.BotSettings import BotSettings
+from lib.helpers.ResolutionScheduler import ResolutionScheduler
+from lib.helpers.Resolver import Priority
+from lib.helpers.GuildQueue import GuildQueue
 
 
 class ConfirmView(nextcord.ui.View):
@@ -121,13 +124,13 @@ class PageView(nextcord.ui.View):
     """
         Discord View that supplies page buttons to children classes.
     """
-    def __init__(self, bot: Bot, ctx: Context, timeout: int):
+    def __init__(self, bot: Bot, ctx: Context, embeds: Embeds, timeout: int):
         super().__init__(timeout=timeout)
         self.ctx = ctx
         self.num_pages = 0
         self.current_page = 0
         self.message = None
-        self.embeds = Embeds(bot)
+        self.embeds = embeds
 
     @nextcord.ui.button(label='<<', style=nextcord.ButtonStyle.gray)
     async def first_(self, button: ui.Button, interaction: Interaction) -> None:
@@ -207,13 +210,12 @@ class HelpView(PageView):
     """
         Discord View to generate the help command and create a UI, displays commands in a page format.
     """
-    def __init__(self, bot, ctx, timeout):
-        super().__init__(bot, ctx, timeout=timeout)
+    def __init__(self, bot, ctx, embeds, timeout):
+        super().__init__(bot, ctx, embeds, timeout=timeout)
         self.ctx = ctx
         self.num_pages = 0
         self.current_page = 0
         self.message = None
-        self.embeds = Embeds(bot)
 
     async def create_message(self) -> None:
         """
@@ -240,14 +242,26 @@ class QueueView(PageView):
     """
         Discord View to generate the queue message and create a UI, displays commands in a page format.
     """
-    def __init__(self, bot: Bot, ctx: Context, queue: list, timeout: int):
-        super().__init__(bot, ctx, timeout=timeout)
+    def __init__(self, bot: Bot, ctx: Context, embeds: Embeds, queue: GuildQueue, timeout: int,
+                 scheduler: ResolutionScheduler = None):
+        super().__init__(bot, ctx, embeds, timeout=timeout)
         self.ctx = ctx
         self.num_pages = 0
         self.current_page = 0
         self.message = None
-        self.embeds = Embeds(bot)
         self.queue = queue
+        self.scheduler = scheduler
+
+    def resolve_page(self) -> None:
+        """
+            Moves unresolved songs on the current page ahead of the backlog
+
+        :return:    None
+        """
+        if self.scheduler is not None:
+            length = self.embeds.queue_display_length
+            page = self.queue[self.current_page * length:(self.current_page + 1) * length]
+            self.scheduler.submit(self.ctx.guild.id, self.queue, page, Priority.VISIBLE)
 
     async def create_message(self) -> None:
         """
@@ -258,6 +272,7 @@ class QueueView(PageView):
         embed, self.num_pages = self.embeds.generate_display_queue(self.ctx, self.queue, self.current_page)
         self.message = await self.ctx.channel.send(embed=embed,
                                                    view=self)
+        self.resolve_page()
 
     async def update_message(self) -> None:
         """
@@ -268,16 +283,16 @@ class QueueView(PageView):
         embed, self.num_pages = self.embeds.generate_display_queue(self.ctx, self.queue, self.current_page)
         await self.message.edit(embed=embed,
                                 view=self)
+        self.resolve_page()
 
 
 class LyricsView(PageView):
-    def __init__(self, bot: Bot, ctx: Context, lyrics: list, title: str, artist: str, timeout: int):
-        super().__init__(bot, ctx, timeout=timeout)
+    def __init__(self, bot: Bot, ctx: Context, embeds: Embeds, lyrics: list, title: str, artist: str, timeout: int):
+        super().__init__(bot, ctx, embeds, timeout=timeout)
         self.ctx = ctx
         self.num_pages = 0
         self.current_page = 0
         self.message = None
-        self.embeds = Embeds(bot)
         self.lyrics = lyrics
         self.title = title
         self.artist = artist
@@ -310,10 +325,9 @@ class SearchView(nextcord.ui.View):
         Creates buttons based on config defined queue display length
     """
 
-    def __init__(self):
+    def __init__(self, settings: BotSettings):
         super().__init__()
-        config = ConfigUtil().read_config('BOT_SETTINGS')
-        self.queue_display_length = config['queue_display_length']
+        self.queue_display_length = settings.queue_display_length
         self.value = None
 
         # Create buttons on object creation
@@ -15,9 +15,12 @@ from nextcord.ext import commands
 from dotenv import load_dotenv
 from lib.helpers.Utils import ConfigUtil, Util
 from lib.helpers.Roles import RoleHandler
+from lib.helpers.DBMetrics import current_call_site
 
 # Create member vars
 config = ConfigUtil()
+# Last-known-good settings let start-up and extension import skip the DB
+has_snapshot = config.load_snapshot()
 extensions = [
     'lib.cogs.commands',
     'lib.cogs.util_commands',
@@ -37,10 +40,19 @@ async def on_ready():
     """
         Called when bot start-up has finished
     """
+    # Sync settings with the DB, in the background if the snapshot already warmed the cache
+    if has_snapshot:
+        bot.loop.create_task(config.reconcile_settings())
+    elif not await config.reconcile_settings():
+        print("Failed to read settings, check DB connection")
+        return
+    # Load shared bot settings once, cogs and helpers read them from memory
+    settings = await config.run_db(config.get_bot_settings)
+
     # Check config validity
-    if not config.validate_config():
+    if not await config.run_db(config.validate_config):
         return
-    server_settings = config.read_config('SERVER_SETTINGS')
+    server_settings = await config.run_db(config.read_config, 'SERVER_SETTINGS')
 
     # Display table of connected guild information
     labels = ['Guild ID', 'Guild Name', 'Guild Owner', 'Prefix', 'Loop']
@@ -54,12 +66,12 @@ async def on_ready():
         print(f"\tConnected to {len(bot.guilds)} servers.")
         Util.display_table(info, labels)
     except BaseException as e:
-        if config.read_config('BOT_SETTINGS')['debug_mode']:
+        if settings.debug_mode:
             print('musicBot.on_ready | {}'.format(format_exc()))
         print('Failed to display server table')
 
     # Check if bot is broken
-    if config.read_config('BOT_SETTINGS')['broken']:
+    if settings.broken:
         await bot.change_presence(activity=nextcord.Activity(type=nextcord.ActivityType.watching, name="Maintenance"))
 
     for extension in extensions:
@@ -69,6 +81,30 @@ async def on_ready():
     await roleHandler.createDJRoleForServers(bot)
 
 
+@bot.before_invoke
+async def set_call_site(ctx: commands.Context):
+    """
+        Tags settings I/O done while a command runs with the command that caused it
+    """
+    cog = ctx.cog.qualified_name if ctx.cog else 'Bot'
+    current_call_site.set(f'{cog}.{ctx.command.qualified_name}')
+
+
+@bot.after_invoke
+async def clear_call_site(ctx: commands.Context):
+    """
+        Stops tagging settings I/O with the command once it is done
+    """
+    current_call_site.set(None)
+
+
 if __name__ == "__main__":
     # Run bot
-    bot.run(TOKEN, reconnect=True)
+    try:
+        bot.run(TOKEN, reconnect=True)
+    finally:
+        # Final queue snapshot, cogs are not unloaded when the bot closes
+        music_commands = bot.get_cog('Commands')
+        if music_commands is not None:
+            music_commands.queues.close_store()
+        config.shutdown()